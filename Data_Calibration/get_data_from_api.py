@@ -1,69 +1,123 @@
+import os
+import sys
 import requests
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from site_registry import SITES
 
-# 配置参数
-batch_size = 20  # 每批次的 tagCodes 数量（可调整）
-output_file_sjz = "shijiazhuang_data.xlsx"  # 石家庄基地的输出文件名
-output_file_yz = "yangzhou_data.xlsx"  # 扬州基地的输出文件名
-
-# 石家庄基地配置
-sjz_url = 'http://10.86.6.3:8081/japrojecttag/timeseries'
-sjz_start_time = "2025-03-28 00:00:00"
-sjz_end_time = "2025-03-28 00:11:00"
-sjz_tagCodes = [
-    "SJ-T-99-9-Edc-0103_AE01_F",
-    "SJ-T-99-9-Edc-0104_AE01_F",
-    "SJ-T-99-9-Edc-0124_AE01_F",
-    # 添加更多 tagCodes...
-]
-
-# 扬州基地配置
-yz_url = "http://localhost:8081/japrojecttag/timeseries"
-yz_start_time = "2025-03-28 00:00:00"
-yz_end_time = "2025-03-28 00:11:00"
-yz_tagCodes = [
-    "SJ-T-99-9-Edc-0103_AE01_F",
-    "SJ-T-99-9-Edc-0104_AE01_F",
-    "SJ-T-99-9-Edc-0124_AE01_F",
-    # 添加更多 tagCodes...
-]
-
-
-def fetch_data(url, start_time, end_time, tagCodes):
+# 复用 Time_Series_Data_Processing 中的取数工具（并发批量请求、重试与退避、速率限制）和导出工具
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Time_Series_Data_Processing'))
+from api_fetcher import BatchFetcher, RateLimiter, call_with_retry, create_session
+from exporter import write_excel
+
+# 配置参数（各基地的 URL、tagCodes、时间范围和批次设置见 site_registry.py）
+request_timeout = 60  # 单个批次请求的超时时间（秒）
+max_retries = 3  # 单个批次失败后的最大重试次数（网络错误、超时、429 和 5xx 会按指数退避重试）
+
+
+def post_batch(session, url, payload, rate_limiter):
+    """
+    发送一次批次请求。
+    :return: 解析后的 JSON 数据；状态码异常时抛出 HTTPError，由 call_with_retry 判断是否重试
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    response = session.post(url, json=payload, timeout=request_timeout)
+    response.raise_for_status()  # 检查请求是否成功
+    return response.json()
+
+
+def fetch_records(site):
     """
-    从 API 获取时序数据。
-    :param url: API 的 URL
-    :param start_time: 起始时间
-    :param end_time: 结束时间
-    :param tagCodes: tagCode 列表
+    按 'records' 格式采集一个站点：请求使用 start_time / end_time，响应为 {'tagCode', 'time', 'tagValue'} 记录列表。
+    各批次并发请求，共享该站点的连接池和速率限制。
+    :param site: site_registry.SITES 中的一项配置
     :return: 数据列表
     """
-    data_list = []
-    # 将 tagCodes 分成多个批次
-    for i in range(0, len(tagCodes), batch_size):
-        batch_tagCodes = tagCodes[i:i + batch_size]
+    tagCodes = site['tagCodes']
+    batch_size = site['batch_size']
+    rate_limiter = RateLimiter(site['rate_limit']) if site.get('rate_limit') else None
+
+    def fetch_batch(batch_tagCodes):
         payload = {
-            "start_time": start_time,
-            "end_time": end_time,
+            "start_time": site['start_time'],
+            "end_time": site['end_time'],
             "tagCodes": batch_tagCodes
         }
-        try:
-            response = requests.post(url, json=payload)
-            response.raise_for_status()  # 检查请求是否成功
-            batch_data = response.json()
+        return call_with_retry(lambda: post_batch(session, site['url'], payload, rate_limiter), max_retries=max_retries)
+
+    data_list = []
+    failed_batches = 0
+    with create_session(site['max_workers']) as session, ThreadPoolExecutor(max_workers=site['max_workers']) as executor:
+        # 将 tagCodes 分成多个批次
+        futures = {
+            executor.submit(fetch_batch, tagCodes[i:i + batch_size]): i // batch_size + 1
+            for i in range(0, len(tagCodes), batch_size)
+        }
+        for future in as_completed(futures):
+            try:
+                batch_data = future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"请求失败，已放弃该批次（第 {futures[future]} 批）: {e}")
+                failed_batches += 1
+                continue
             if isinstance(batch_data, list):  # 确保返回的是列表
                 data_list.extend(batch_data)
             else:
                 print(f"警告：API 返回的数据不是列表，跳过该批次。返回内容：{batch_data}")
-        except requests.exceptions.RequestException as e:
-            print(f"请求失败: {e}")
+    if failed_batches:
+        print(f"警告：{failed_batches} 个批次在重试后仍然失败，数据不完整。")
     return data_list
 
 
+def fetch_timeseries(site):
+    """
+    按 'timeseries' 格式采集一个站点：通过 BatchFetcher 请求（startTime / endTime，响应为 data[].timeseries），
+    再展开为逐个数据点的记录。
+    :param site: site_registry.SITES 中的一项配置
+    :return: 数据列表，每项为 {'tagCode': ..., 'time': ..., 'tagValue': ...}
+    """
+    with BatchFetcher(site['url'], batch_size=site['batch_size'], max_workers=site['max_workers'],
+                      timeout=request_timeout, max_retries=max_retries,
+                      rate_limit=site.get('rate_limit')) as fetcher:
+        items = fetcher.fetch(site['tagCodes'], site['start_time'], site['end_time'])
+
+    # 展开为逐个数据点的记录
+    return [
+        {'tagCode': item['tagCode'], 'time': point['time'], 'tagValue': point['tagValue']}
+        for item in items
+        for point in item.get('timeseries') or []
+    ]
+
+
+# 各请求/响应格式对应的采集函数
+FETCHERS = {'records': fetch_records, 'timeseries': fetch_timeseries}
+
+
+def fetch_data(site):
+    """
+    从 API 获取一个站点的时序数据，按站点配置的 payload_style 选择请求/响应格式，每个站点使用独立的连接池和速率限制。
+    :param site: site_registry.SITES 中的一项配置
+    :return: 数据列表，每项为 {'tagCode': ..., 'time': ..., 'tagValue': ...}
+    """
+    payload_style = site.get('payload_style', 'records')
+    if payload_style not in FETCHERS:
+        raise ValueError(f"不支持的 payload_style: {payload_style}，可选: {list(FETCHERS)}")
+    return FETCHERS[payload_style](site)
+
+
+def collect_site(name, site):
+    """采集一个站点的数据并立即写出该站点的输出文件"""
+    print(f"正在获取 {name} 基地数据...")
+    data = fetch_data(site)
+    save_to_excel(data, site['output_file'])
+    return len(data)
+
+
 def save_to_excel(data, filename):
     """
-    将数据保存为 Excel 文件。
+    将数据保存为 Excel 文件（数据量超过单个工作表的行数上限时自动拆分为多个工作表）。
     :param data: 数据列表
     :param filename: 输出文件名
     """
@@ -87,22 +141,21 @@ def save_to_excel(data, filename):
     df = pd.DataFrame(valid_data, columns=["tagCode", "time", "tagValue"])
     # 确保 time 列是 datetime 类型
     df['time'] = pd.to_datetime(df['time'])
-    # 保存为 Excel 文件
-    df.to_excel(filename, index=False)
-    print(f"数据已保存到 {filename}")
+    # 流式写入 Excel 文件，超过单个工作表的行数上限时自动拆分工作表
+    write_excel(df, filename)
 
 
 def main():
-    # 获取石家庄基地数据
-    print("正在获取石家庄基地数据...")
-    sjz_data = fetch_data(sjz_url, sjz_start_time, sjz_end_time, sjz_tagCodes)
-    save_to_excel(sjz_data, output_file_sjz)
-
-    # 获取扬州基地数据
-    print("正在获取扬州基地数据...")
-    yz_data = fetch_data(yz_url, yz_start_time, yz_end_time, yz_tagCodes)
-    save_to_excel(yz_data, output_file_yz)
+    # 所有站点同时采集，总耗时取决于最慢的站点；每个站点完成后立即写出结果
+    with ThreadPoolExecutor(max_workers=len(SITES)) as executor:
+        futures = {executor.submit(collect_site, name, site): name for name, site in SITES.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                print(f"{name} 基地采集完成，共 {future.result()} 个数据点")
+            except Exception as e:
+                print(f"{name} 基地采集失败: {e}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,55 @@
+"""
+site_registry.py
+
+各基地的取数配置，get_data_from_api.py 会并发采集这里登记的所有站点。
+每个站点一项，字段说明：
+- url: 该站点的时序数据接口地址
+- tagCodes: 需要采集的 tagCode 列表
+- start_time / end_time: 采集的时间范围
+- batch_size: 每批次的 tagCodes 数量
+- max_workers: 该站点同时在途的批次数量（每个站点使用独立的连接池）
+- rate_limit: 该站点每秒请求数上限，None 表示不限制
+- payload_style: 该站点接口的请求/响应格式，缺省为 'records'
+    'records'     请求 {"start_time", "end_time", "tagCodes"}，响应为记录列表 [{"tagCode", "time", "tagValue"}, ...]
+    'timeseries'  请求 {"startTime", "endTime", "tagCodes"}，响应为 {"data": [{"tagCode", "timeseries": [...]}, ...]}，
+                  与 Time_Series_Data_Processing 使用的接口相同
+- output_file: 输出的 Excel 文件名
+新增基地时只需要在 SITES 中添加一项。
+"""
+
+SITES = {
+    # 石家庄基地
+    'shijiazhuang': {
+        'url': 'http://10.86.6.3:8081/japrojecttag/timeseries',
+        'tagCodes': [
+            "SJ-T-99-9-Edc-0103_AE01_F",
+            "SJ-T-99-9-Edc-0104_AE01_F",
+            "SJ-T-99-9-Edc-0124_AE01_F",
+            # 添加更多 tagCodes...
+        ],
+        'start_time': "2025-03-28 00:00:00",
+        'end_time': "2025-03-28 00:11:00",
+        'batch_size': 20,
+        'max_workers': 4,
+        'rate_limit': 5,
+        'payload_style': 'records',
+        'output_file': "shijiazhuang_data.xlsx",
+    },
+    # 扬州基地
+    'yangzhou': {
+        'url': "http://localhost:8081/japrojecttag/timeseries",
+        'tagCodes': [
+            "SJ-T-99-9-Edc-0103_AE01_F",
+            "SJ-T-99-9-Edc-0104_AE01_F",
+            "SJ-T-99-9-Edc-0124_AE01_F",
+            # 添加更多 tagCodes...
+        ],
+        'start_time': "2025-03-28 00:00:00",
+        'end_time': "2025-03-28 00:11:00",
+        'batch_size': 20,
+        'max_workers': 4,
+        'rate_limit': 5,
+        'payload_style': 'records',
+        'output_file': "yangzhou_data.xlsx",
+    },
+}
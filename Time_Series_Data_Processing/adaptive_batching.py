@@ -0,0 +1,99 @@
+import threading
+
+"""
+adaptive_batching.py
+
+根据实际观测到的响应耗时、响应大小和错误情况，自动调整每次请求的 tag 数量（batch_size）和并发数，
+不再需要为每个站点手工摸索 batch_size。调整策略为“加性增、乘性减”：
+1. 请求成功且每个 tag 的平均耗时没有明显变差（不超过基准的 1 + latency_tolerance 倍）时，逐步增大 batch_size，
+   并在连续成功若干次后增加 1 个并发；
+2. 每个 tag 的平均耗时明显变差、响应体超过 max_response_bytes 或耗时接近超时时间时，batch_size 乘以 0.75；
+3. 出现超时、网络错误、429 或 5xx 时，batch_size 和并发数都减半。
+"""
+
+
+class AdaptiveBatchController:
+    def __init__(self, batch_size=5, concurrency=2, min_batch_size=1, max_batch_size=200, max_concurrency=8,
+                 latency_tolerance=0.3, max_response_bytes=20 * 1024 * 1024, timeout=None, smoothing=0.3):
+        """
+        :param batch_size: 初始 batch_size
+        :param concurrency: 初始并发数
+        :param min_batch_size: batch_size 下限
+        :param max_batch_size: batch_size 上限
+        :param max_concurrency: 并发数上限，一般等于 BatchFetcher 的 max_workers
+        :param latency_tolerance: 每个 tag 的平均耗时相对基准允许变差的比例，超过则视为服务端开始吃力
+        :param max_response_bytes: 单次响应体大小上限，超过时减小 batch_size
+        :param timeout: 请求超时时间（秒），耗时超过其 80% 时减小 batch_size
+        :param smoothing: 耗时指数平滑系数
+        """
+        self.batch_size = batch_size
+        self.concurrency = min(concurrency, max_concurrency)
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.latency_tolerance = latency_tolerance
+        self.max_response_bytes = max_response_bytes
+        self.timeout = timeout
+        self.smoothing = smoothing
+        self.smoothed_latency = None  # 平滑后的每个 tag 平均耗时（秒）
+        self.baseline_latency = None  # 观测到的最小平滑耗时，作为基准
+        self.success_streak = 0
+        self.lock = threading.Lock()
+
+    def _set(self, batch_size, concurrency, reason):
+        batch_size = max(self.min_batch_size, min(self.max_batch_size, batch_size))
+        concurrency = max(1, min(self.max_concurrency, concurrency))
+        if (batch_size, concurrency) != (self.batch_size, self.concurrency):
+            print(f"自适应调整（{reason}）: batch_size {self.batch_size} -> {batch_size}, "
+                  f"并发 {self.concurrency} -> {concurrency}")
+            self.batch_size = batch_size
+            self.concurrency = concurrency
+
+    def on_success(self, tag_count, elapsed, byte_count):
+        """
+        记录一次成功的请求。
+        :param tag_count: 本次请求的 tag 数量
+        :param elapsed: 本次请求耗时（秒），经过重试的请求传入 None，此时不做调整（耗时中包含退避等待）
+        :param byte_count: 响应体字节数
+        """
+        with self.lock:
+            if elapsed is None:
+                return
+            per_tag = elapsed / max(tag_count, 1)
+            if self.smoothed_latency is None:
+                self.smoothed_latency = per_tag
+            else:
+                self.smoothed_latency += self.smoothing * (per_tag - self.smoothed_latency)
+            if self.baseline_latency is None or self.smoothed_latency < self.baseline_latency:
+                self.baseline_latency = self.smoothed_latency
+            else:
+                # 基准缓慢向当前耗时靠拢，避免服务端整体变慢后一直停留在最小 batch_size
+                self.baseline_latency += 0.01 * (self.smoothed_latency - self.baseline_latency)
+
+            if byte_count > self.max_response_bytes:
+                self._set(int(self.batch_size * 0.75), self.concurrency, "响应体过大")
+                return
+            if self.timeout is not None and elapsed > 0.8 * self.timeout:
+                self._set(int(self.batch_size * 0.75), self.concurrency, "耗时接近超时")
+                return
+            if self.smoothed_latency > self.baseline_latency * (1 + 2 * self.latency_tolerance):
+                self.success_streak = 0
+                self._set(int(self.batch_size * 0.75), self.concurrency, "耗时变差")
+                return
+            if self.smoothed_latency > self.baseline_latency * (1 + self.latency_tolerance):
+                # 处于容忍区间内，保持不变
+                return
+
+            # 耗时平稳：增大 batch_size，连续成功的次数达到当前并发数后再增加一个并发
+            self.success_streak += 1
+            concurrency = self.concurrency
+            if self.success_streak >= self.concurrency:
+                self.success_streak = 0
+                concurrency += 1
+            self._set(self.batch_size + max(1, self.batch_size // 4), concurrency, "耗时平稳")
+
+    def on_failure(self, error=None):
+        """记录一次失败（超时、网络错误、429 或 5xx），batch_size 和并发数减半"""
+        with self.lock:
+            self.success_streak = 0
+            self._set(self.batch_size // 2, self.concurrency // 2, f"请求失败: {type(error).__name__}")
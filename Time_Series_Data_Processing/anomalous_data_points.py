@@ -4,6 +4,8 @@ import pandas as pd
 from scipy import stats
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots  # 导入 make_subplots
+from parquet_store import read_store
+from mmap_store import MmapSeriesStore
 
 
 # 下面这两行是使用jupyter notebook的时候，用于在notebook中显示图表的设置
@@ -11,21 +13,42 @@ import plotly.offline as py
 py.init_notebook_mode(connected=True)
 
 # %run get_data_from_api.py
-# 从.pkl文件读取原始数据
-combined_cut_df = pd.read_pickle(rf'../Time_Series_Data_Processing/data_outputs/combined_cut_df.pkl')
-print(combined_cut_df)
-
-# 获取不重复的tagCode并存储在列表中
-tag_codes = combined_cut_df['tagCode'].unique().tolist()
+# 是否从内存映射存储中按 tag 读取数据：分析数月的数据时不需要把全部数据读入内存
+use_mmap_store = False
+# 分析的时间范围，None 表示全部
+start_time = None
+end_time = None
+
+if use_mmap_store:
+    mmap_store = MmapSeriesStore(rf'../Time_Series_Data_Processing/data_outputs/mmap_store')
+    # consumption_delta 计算的用量（diff），与 mmap_store 按相同的时间轴对齐
+    mmap_diff_store = MmapSeriesStore(rf'../Time_Series_Data_Processing/data_outputs/mmap_store_diff')
+    tag_codes = mmap_store.tagCodes
+else:
+    # 从 Parquet 存储中读取原始数据（只需要 time、tagCode、tagValue、diff 四列，可按需指定时间范围和 tagCodes）
+    combined_cut_df = read_store(rf'../Time_Series_Data_Processing/data_outputs/parquet_store',
+                                 columns=['time', 'tagCode', 'tagValue', 'diff'], start_time=start_time, end_time=end_time)
+    print(combined_cut_df)
+
+    # 获取不重复的tagCode并存储在列表中
+    tag_codes = combined_cut_df['tagCode'].unique().tolist()
 
 # 创建一个ExcelWriter对象
 with pd.ExcelWriter('tag_code_analysis.xlsx') as writer:
     for tag_code in tag_codes:
         # 生成对应tagCode的数据框
-        tag_df = combined_cut_df[combined_cut_df['tagCode'] == tag_code].copy()
-
-        # 读取tagValue，新增一个diff列
-        tag_df['diff'] = tag_df['tagValue'].diff().fillna(0).astype(float)
+        if use_mmap_store:
+            tag_series = mmap_store.series(tag_code, start_time, end_time).dropna()
+            tag_df = pd.DataFrame({'time': tag_series.index, 'tagCode': tag_code, 'tagValue': tag_series.to_numpy()})
+            if tag_code in mmap_diff_store.index:
+                diff_series = mmap_diff_store.series(tag_code, start_time, end_time)
+                tag_df['diff'] = diff_series.reindex(tag_series.index).to_numpy()
+        else:
+            tag_df = combined_cut_df[combined_cut_df['tagCode'] == tag_code].copy()
+
+        # 读取tagValue，新增一个diff列（Parquet 存储或 mmap_store_diff 中已有 consumption_delta 计算的用量时直接使用）
+        if 'diff' not in tag_df:
+            tag_df['diff'] = tag_df['tagValue'].diff().fillna(0).astype(float)
 
         # 计算z-score、平均值、中位数、标准差
         diff_without_first = tag_df['diff'][1:]
@@ -0,0 +1,507 @@
+import os
+import json
+import time
+import uuid
+import random
+import threading
+import requests
+import pandas as pd
+from requests.adapters import HTTPAdapter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from json_stream import iter_array_items
+
+"""
+api_fetcher.py
+
+并发批量请求 /japrojecttag/timeseries 接口的取数引擎，供 get_data_from_api.py 等脚本复用。
+主要功能如下：
+1. 将 tagCodes 按 batch_size 切分为多个批次，使用线程池同时保持 max_workers 个批次在途。
+2. 所有请求复用同一个带连接池的 requests.Session，避免每次请求重新建立 TCP 连接。
+3. 可按 slice_size（如 '6h'、'1d'）将长时间范围切分为多个时间片，并发请求 (tag 批次 × 时间片) 网格，
+   再按时间片顺序拼接为每个 tag 的连续序列，并去掉时间片边界处的重复点，从而限制单次响应的大小。
+4. 按传入 tagCodes 的顺序返回每个 tag 的响应项（与接口 data 列表中的元素格式一致，包含 tagCode 和 timeseries）。
+5. streaming=True 时边读取响应流边解析 data 数组（见 json_stream.py），配合 fetch_stream 把每个数据项
+   直接交给调用方（如 ColumnarBuilder.add_item），单个在途请求的内存占用不随时间范围增长。
+   每个批次完成后只打印一行摘要（tag 数、数据点数、字节数、耗时），不再打印完整响应。
+6. 每个批次带超时时间，网络错误、超时、429 和 5xx 响应按指数退避加随机抖动重试（call_with_retry）；
+   传入 FetchCheckpoint 时，每个 (批次, 时间片) 单元的数据项在解析时逐行写入检查点文件，单元完成后写入完成标记，
+   程序中断后重新运行会跳过已完成的单元。
+7. 传入 AdaptiveBatchController 时，按观测到的耗时、响应大小和错误情况动态调整 batch_size 和并发数（见 adaptive_batching.py）。
+8. 可设置 rate_limit（每秒请求数上限），同一个 BatchFetcher 的所有线程共享该限制。
+
+使用方法：
+    fetcher = BatchFetcher(url, batch_size=5, max_workers=8, slice_size='1d')
+    for item in fetcher.fetch(tagCodes, start_time, end_time):
+        timeseries_data = item.get('timeseries')
+"""
+
+# 默认的时序数据接口地址
+DEFAULT_URL = 'http://10.86.6.3:8081/japrojecttag/timeseries'
+# 接口使用的时间格式
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def create_session(pool_size):
+    """创建带连接池的 Session，连接池大小应不小于并发数"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def is_retryable_error(error):
+    """判断异常是否值得重试：网络错误、超时、响应不完整，以及 429 和 5xx 状态码"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, (requests.exceptions.RequestException, ValueError))
+
+
+def call_with_retry(func, max_retries=3, backoff_base=1.0, backoff_max=30.0, on_error=None):
+    """
+    调用 func，遇到可重试的异常时按指数退避加随机抖动重试。
+    :param max_retries: 最大重试次数（不含第一次调用）
+    :param backoff_base: 第一次重试的最大等待秒数，之后每次翻倍
+    :param backoff_max: 单次等待的秒数上限
+    :param on_error: 可选的回调函数，每次出现可重试的异常时调用 on_error(异常)
+    :return: func 的返回值；重试用尽或遇到不可重试的异常时抛出最后一次的异常
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            retryable = is_retryable_error(e)
+            if retryable and on_error is not None:
+                on_error(e)
+            if attempt == max_retries or not retryable:
+                raise
+            # 全抖动：在 [0, 退避上限] 内随机等待，避免大量请求同时重试
+            delay = random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+            print(f"请求失败: {e}，{delay:.1f} 秒后进行第 {attempt + 1} 次重试")
+            time.sleep(delay)
+
+
+class FetchCheckpoint:
+    def __init__(self, path, sync_interval=5.0):
+        """
+        记录已完成的 (批次, 时间片) 请求单元及其数据，程序中断后重新运行时跳过这些单元。
+        文件为 JSON Lines 格式，数据项在解析出来时逐行追加，不在内存中缓存整个单元：
+            {"unit": 单元编号, "item": 数据项}                                         每个数据项一行
+            {"unit": 单元编号, "startTime": ..., "endTime": ..., "tagCodes": [...]}    单元完成标记
+        多个单元并发写入时各行交错出现，读取时按单元编号归类，没有完成标记的单元（中断或失败）整体丢弃。
+        :param path: 检查点文件路径
+        :param sync_interval: 两次 fsync 之间的最短间隔（秒）；完成标记写入后总是 flush 到操作系统，
+                              程序中断不会丢失，只有系统崩溃时可能丢失最近 sync_interval 秒内完成的单元
+        """
+        self.path = path
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.completed = {}  # (startTime, endTime) -> 已完成的 tagCode 集合
+        self.items = {}  # (startTime, endTime) -> 检查点文件中已保存的数据项
+        self.file = None
+        self.last_sync = time.monotonic()
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        unfinished = {}  # 单元编号 -> 尚未读到完成标记的数据项
+        with open(self.path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 中断时只写了一半的行
+            if 'item' in record:
+                unfinished.setdefault(record['unit'], []).append(record['item'])
+                continue
+            window = (record['startTime'], record['endTime'])
+            self.completed.setdefault(window, set()).update(record['tagCodes'])
+            # 旧格式的记录整个单元在同一行的 data 中
+            items = record['data'] if 'data' in record else unfinished.pop(record['unit'], [])
+            self.items.setdefault(window, []).extend(items)
+        # 补齐被中断的最后一行，保证之后追加的记录从新行开始
+        if content and not content.endswith('\n'):
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n')
+        print(f"从检查点 {self.path} 恢复 {sum(len(tags) for tags in self.completed.values())} 个已完成的 (tag, 时间片)")
+
+    def pending(self, start_time, end_time, tagCodes):
+        """返回该时间片内尚未完成的 tagCode"""
+        done = self.completed.get((start_time, end_time), set())
+        return [tag for tag in tagCodes if tag not in done]
+
+    def saved_items(self, start_time, end_time):
+        """返回该时间片内检查点文件中已保存的数据项"""
+        return self.items.get((start_time, end_time), [])
+
+    def _write(self, record, finish=False):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(line + '\n')
+            if finish:
+                self.file.flush()
+                now = time.monotonic()
+                if now - self.last_sync >= self.sync_interval:
+                    os.fsync(self.file.fileno())
+                    self.last_sync = now
+
+    def open_unit(self):
+        """开始一个请求单元，返回单元编号，之后用 write_item 逐项写入、用 finish_unit 标记完成"""
+        return uuid.uuid4().hex
+
+    def write_item(self, unit, item):
+        """追加单元中的一个数据项（不在内存中保留）"""
+        self._write({"unit": unit, "item": item})
+
+    def finish_unit(self, unit, start_time, end_time, batch_tagCodes):
+        """写入单元完成标记，之后重新运行时跳过该单元"""
+        self._write({"unit": unit, "startTime": start_time, "endTime": end_time, "tagCodes": batch_tagCodes},
+                    finish=True)
+        with self.lock:
+            self.completed.setdefault((start_time, end_time), set()).update(batch_tagCodes)
+
+    def record(self, start_time, end_time, batch_tagCodes, items):
+        """追加一个已完成的单元及其全部数据项"""
+        unit = self.open_unit()
+        for item in items:
+            self.write_item(unit, item)
+        self.finish_unit(unit, start_time, end_time, batch_tagCodes)
+
+    def close(self):
+        """落盘并关闭检查点文件"""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+
+    def clear(self):
+        """全部请求完成后删除检查点文件"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.completed = {}
+            self.items = {}
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        """
+        多个线程共享的请求速率限制，相邻两次请求至少间隔 1 / rate 秒。
+        :param rate: 每秒请求数上限
+        """
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def acquire(self):
+        """等待到允许发送下一次请求的时刻"""
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def count_bytes(chunks, counter):
+    """透传字节块，同时把累计字节数记录到 counter[0]"""
+    for chunk in chunks:
+        counter[0] += len(chunk)
+        yield chunk
+
+
+def split_batches(tagCodes, batch_size):
+    """将 tagCodes 按 batch_size 切分为多个批次"""
+    return [tagCodes[i:i + batch_size] for i in range(0, len(tagCodes), batch_size)]
+
+
+def split_time_range(start_time, end_time, slice_size=None):
+    """
+    将 [start_time, end_time] 切分为首尾相接的多个时间片。
+    :param slice_size: 时间片长度，如 '6h'、'1d' 或 timedelta；None 表示不切分
+    :return: [(片起始时间, 片截止时间), ...]，时间均为接口使用的字符串格式
+    """
+    if slice_size is None:
+        return [(start_time, end_time)]
+
+    step = pd.to_timedelta(slice_size)
+    if step <= pd.Timedelta(0):
+        raise ValueError(f"slice_size 必须为正数: {slice_size}")
+
+    start = pd.Timestamp(start_time)
+    end = pd.Timestamp(end_time)
+    windows = []
+    while start < end:
+        stop = min(start + step, end)
+        windows.append((start.strftime(TIME_FORMAT), stop.strftime(TIME_FORMAT)))
+        start = stop
+    return windows or [(start_time, end_time)]
+
+
+def stitch_timeseries(tagCode, parts):
+    """
+    按时间片顺序拼接同一个 tag 的多个响应项，去掉时间片边界处的重复点。
+    :param parts: 各时间片的响应项列表，接口未返回的时间片为 None
+    :return: 拼接后的响应项，所有时间片均未返回时为 None
+    """
+    parts = [part for part in parts if part is not None]
+    if len(parts) <= 1:
+        return parts[0] if parts else None
+
+    series = [part.get('timeseries') for part in parts]
+    if all(points is None for points in series):
+        return {'tagCode': tagCode, 'timeseries': None}
+
+    merged = []
+    for points in series:
+        if not points:
+            continue
+        # 相邻时间片共享边界时刻，跳过下一片开头不晚于已拼接末尾的点（同一接口返回的时间字符串格式一致，可直接比较）
+        skip = 0
+        if merged:
+            last_time = merged[-1]['time']
+            while skip < len(points) and points[skip]['time'] <= last_time:
+                skip += 1
+        merged.extend(points[skip:])
+    return {'tagCode': tagCode, 'timeseries': merged}
+
+
+class BatchFetcher:
+    def __init__(self, url=DEFAULT_URL, batch_size=5, max_workers=4, slice_size=None, timeout=60, session=None,
+                 streaming=False, chunk_size=64 * 1024, max_retries=3, backoff_base=1.0, backoff_max=30.0,
+                 checkpoint=None, controller=None, rate_limit=None):
+        """
+        :param url: API 的 URL
+        :param batch_size: 每次请求包含的 tagCode 数量
+        :param max_workers: 同时在途的批次数量
+        :param slice_size: 时间片长度，如 '6h'、'1d'；None 表示整个时间范围一次请求
+        :param timeout: 单个批次请求的超时时间（秒），None 表示不限制
+        :param session: 可传入已有的 Session，默认新建一个连接池大小为 max_workers 的 Session
+        :param streaming: 是否以流的方式读取并增量解析响应
+        :param chunk_size: 流式读取时每次读取的字节数
+        :param max_retries: 单个批次失败后的最大重试次数
+        :param backoff_base: 第一次重试的最大等待秒数，之后每次翻倍
+        :param backoff_max: 单次重试等待的秒数上限
+        :param checkpoint: 可选的 FetchCheckpoint，用于中断后续跑
+        :param controller: 可选的 AdaptiveBatchController；传入时 batch_size 和并发数由其动态决定，
+                           max_workers 作为并发数上限
+        :param rate_limit: 每秒请求数上限（含重试），None 表示不限制
+        """
+        self.url = url
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.slice_size = slice_size
+        self.timeout = timeout
+        self.session = session or create_session(max_workers)
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.checkpoint = checkpoint
+        self.controller = controller
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.failed_units = []  # 重试用尽仍失败的 (批次, 起始时间, 截止时间)，在 fetcher 生命周期内累计
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+    def _fetch_batch_once(self, data, on_item, stats):
+        """发送一次请求并解析响应，状态码异常时抛出 HTTPError，交给 call_with_retry 判断是否重试"""
+        collected = []
+        stats.update(tags=0, points=0, bytes=[0], attempts=stats.get('attempts', 0) + 1)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        with self.session.post(self.url, json=data, timeout=self.timeout, stream=self.streaming) as response:
+            response.raise_for_status()
+
+            if self.streaming:
+                # 边读边解析 data 数组，不在内存中保留完整的响应体
+                items = iter_array_items(count_bytes(response.iter_content(chunk_size=self.chunk_size),
+                                                     stats['bytes']), required=True)
+            else:
+                json_data = response.json()
+                stats['bytes'][0] = len(response.content)
+                # 检查 'data' 是否存在且是列表；缺失或为 null 时抛出 ValueError，按失败重试，不记为已完成
+                if not (json_data and 'data' in json_data and isinstance(json_data['data'], list)):
+                    raise ValueError("响应格式不正确：data 字段缺失或不是列表")
+                items = json_data['data']
+
+            for item in items:
+                stats['tags'] += 1
+                stats['points'] += len(item.get('timeseries') or [])
+                if on_item is None:
+                    collected.append(item)
+                else:
+                    on_item(item)
+        return collected
+
+    def fetch_batch(self, batch_tagCodes, start_time, end_time, on_item=None):
+        """
+        请求单个批次的数据，失败时按退避策略重试，完成后打印一行批次摘要（tag 数、数据点数、字节数、耗时）。
+        :param on_item: 可选的回调函数，传入时每解析出一个数据项就调用 on_item(item)，不再收集返回；
+                        流式读取中途失败重试时，已交付的数据项可能被重复交付，调用方需要去重
+        :return: 响应中的 data 列表（传入 on_item 时为空列表）；重试用尽仍失败时返回 None
+        """
+        data = {
+            "tagCodes": batch_tagCodes,
+            "startTime": start_time,
+            "endTime": end_time
+        }
+        started = time.perf_counter()
+        stats = {}
+        on_error = self.controller.on_failure if self.controller is not None else None
+        try:
+            collected = call_with_retry(lambda: self._fetch_batch_once(data, on_item, stats),
+                                        self.max_retries, self.backoff_base, self.backoff_max, on_error)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"请求失败，已放弃该批次: {start_time} ~ {end_time}, tags {len(batch_tagCodes)}, 错误: {e}")
+            return None
+
+        elapsed = time.perf_counter() - started
+        if self.controller is not None:
+            # 重试过的请求耗时包含退避等待，不计入耗时统计
+            self.controller.on_success(len(batch_tagCodes), elapsed if stats['attempts'] == 1 else None,
+                                       stats['bytes'][0])
+        print(f"批次完成: {start_time} ~ {end_time}, tags {stats['tags']}/{len(batch_tagCodes)}, "
+              f"数据点 {stats['points']}, 字节 {stats['bytes'][0]}, 耗时 {elapsed:.2f}s")
+        return collected
+
+    def _fetch_unit(self, batch_tagCodes, start_time, end_time, on_item):
+        """执行一个 (批次, 时间片) 请求单元，成功后写入检查点"""
+        if self.checkpoint is None:
+            return self.fetch_batch(batch_tagCodes, start_time, end_time, on_item)
+
+        if on_item is None:
+            items = self.fetch_batch(batch_tagCodes, start_time, end_time)
+            if items is not None:
+                self.checkpoint.record(start_time, end_time, batch_tagCodes, items)
+            return items
+
+        # 流式交付的同时逐项写入检查点，单元成功后再写入完成标记
+        unit = self.checkpoint.open_unit()
+
+        def tee(item):
+            self.checkpoint.write_item(unit, item)
+            on_item(item)
+
+        result = self.fetch_batch(batch_tagCodes, start_time, end_time, tee)
+        if result is not None:
+            self.checkpoint.finish_unit(unit, start_time, end_time, batch_tagCodes)
+        return result
+
+    def _fetch_units(self, tagCodes, windows, on_item=None, on_result=None):
+        """
+        并发执行所有 (批次 × 时间片) 请求单元，检查点中已完成的 tag 不再请求。
+        批次在提交时才按当前的 batch_size 切分，并发数不超过当前允许值，便于自适应调整即时生效。
+        :param on_result: 每个单元成功后调用 on_result(时间片序号, 数据项列表)
+        """
+        # 待请求队列：每个时间片一项 (时间片序号, 尚未提交的 tagCode 列表)
+        queue = deque()
+        for window_index, (window_start, window_end) in enumerate(windows):
+            pending = tagCodes
+            if self.checkpoint is not None:
+                pending = self.checkpoint.pending(window_start, window_end, tagCodes)
+            if pending:
+                queue.append((window_index, pending))
+
+        failed_before = len(self.failed_units)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while queue or running:
+                batch_size, concurrency = self.batch_size, self.max_workers
+                if self.controller is not None:
+                    batch_size, concurrency = self.controller.batch_size, self.controller.concurrency
+
+                # 补足在途请求
+                while queue and len(running) < concurrency:
+                    window_index, pending = queue.popleft()
+                    batch, rest = pending[:batch_size], pending[batch_size:]
+                    if rest:
+                        queue.appendleft((window_index, rest))
+                    window_start, window_end = windows[window_index]
+                    future = executor.submit(self._fetch_unit, batch, window_start, window_end, on_item)
+                    running[future] = (window_index, batch)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window_index, batch = running.pop(future)
+                    items = future.result()
+                    if items is None:
+                        self.failed_units.append((batch, *windows[window_index]))
+                    elif on_result is not None:
+                        on_result(window_index, items)
+
+        failed_count = len(self.failed_units) - failed_before
+        if failed_count:
+            print(f"警告: {failed_count} 个批次在重试后仍然失败，数据不完整。")
+
+    def fetch(self, tagCodes, start_time, end_time, return_failed=False):
+        """
+        并发请求所有 (批次 × 时间片)，拼接时间片后按 tagCodes 的顺序返回每个 tag 的响应项。
+        部分时间片失败的 tag 仍会返回由成功的时间片拼接的响应项，需要区分时用 return_failed 取得失败的时间片。
+        :param tagCodes: tagCode 列表
+        :param start_time: 起始时间
+        :param end_time: 结束时间
+        :param return_failed: 为 True 时返回 (响应项列表, {tagCode: [(片起始时间, 片截止时间), ...]})，
+                              后者为本次调用中重试用尽仍失败的时间片（时间片划分同 split_time_range）
+        :return: 响应项列表，每项为 {'tagCode': ..., 'timeseries': [...]}；失败的批次记录在 failed_units 中
+        """
+        windows = split_time_range(start_time, end_time, self.slice_size)
+        failed_before = len(self.failed_units)
+        # 每个时间片一个字典：tagCode -> 响应项
+        items_by_window = [{} for _ in windows]
+
+        def collect(window_index, items):
+            items_by_tag = items_by_window[window_index]
+            for item in items:
+                items_by_tag.setdefault(item.get('tagCode'), item)
+
+        if self.checkpoint is not None:
+            for window_index, (window_start, window_end) in enumerate(windows):
+                collect(window_index, self.checkpoint.saved_items(window_start, window_end))
+        self._fetch_units(tagCodes, windows, on_result=collect)
+
+        # 按传入顺序输出，接口未返回的 tag 直接跳过
+        items = []
+        for tag in tagCodes:
+            item = stitch_timeseries(tag, [items_by_tag.get(tag) for items_by_tag in items_by_window])
+            if item is not None:
+                items.append(item)
+        if not return_failed:
+            return items
+        failed = {}
+        for batch, window_start, window_end in self.failed_units[failed_before:]:
+            for tag in batch:
+                failed.setdefault(tag, []).append((window_start, window_end))
+        return items, failed
+
+    def fetch_stream(self, tagCodes, start_time, end_time, on_item):
+        """
+        并发请求所有 (批次 × 时间片)，每解析出一个数据项就调用 on_item(item)，不在内存中汇总结果。
+        on_item 会在多个工作线程中被调用，需要是线程安全的。
+        各时间片的数据项分别交付、不做拼接，边界处和重试时的重复点由调用方去重（如 ColumnarBuilder.build(deduplicate=True)）。
+        """
+        windows = split_time_range(start_time, end_time, self.slice_size)
+        if self.checkpoint is not None:
+            for window_start, window_end in windows:
+                for item in self.checkpoint.saved_items(window_start, window_end):
+                    on_item(item)
+        self._fetch_units(tagCodes, windows, on_item=on_item)
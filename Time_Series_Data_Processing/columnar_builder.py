@@ -0,0 +1,101 @@
+import threading
+import numpy as np
+import pandas as pd
+from api_fetcher import TIME_FORMAT
+
+"""
+columnar_builder.py
+
+将接口响应中的 time / tagValue 数组直接收集到列式缓冲区中，最后一次性构建合并后的 DataFrame，
+替代“每个 tag 构建一个小 DataFrame、分别解析时间、再 pd.concat 数百个小表”的做法。
+1. time、tagValue 写入预分配的 numpy 缓冲区，容量不足时按倍数扩容；
+2. tagCode 只记录整数编码，构建时转换为按字母排序的分类列（categorical），排序结果与字符串一致；
+3. time 列在构建时使用显式格式统一解析一次；
+4. add / add_item 加锁，可以直接作为 BatchFetcher.fetch_stream 的回调在多个线程中调用。
+"""
+
+
+class ColumnarBuilder:
+    def __init__(self, capacity=1024, time_format=TIME_FORMAT):
+        """
+        :param capacity: 缓冲区初始容量（数据点个数），已知数据量时可直接传入以避免扩容
+        :param time_format: time 列的解析格式
+        """
+        self.time_format = time_format
+        self.size = 0
+        self.times = np.empty(capacity, dtype=object)
+        self.values = np.empty(capacity, dtype=object)
+        self.codes = np.empty(capacity, dtype=np.int32)
+        self.tag_ids = {}  # tagCode -> 整数编码
+        self.lock = threading.Lock()
+
+    def _reserve(self, count):
+        """确保缓冲区还能再写入 count 个数据点"""
+        required = self.size + count
+        capacity = len(self.codes)
+        if required <= capacity:
+            return
+        while capacity < required:
+            capacity = max(capacity * 2, 1)
+        for name in ('times', 'values', 'codes'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, tagCode, timeseries):
+        """追加一个 tag 的数据点列表 [{'time': ..., 'tagValue': ...}, ...]"""
+        count = len(timeseries)
+        if count == 0:
+            return
+        times = [point['time'] for point in timeseries]
+        values = [point['tagValue'] for point in timeseries]
+        with self.lock:
+            self._reserve(count)
+            start, stop = self.size, self.size + count
+            self.times[start:stop] = times
+            self.values[start:stop] = values
+            self.codes[start:stop] = self.tag_ids.setdefault(tagCode, len(self.tag_ids))
+            self.size = stop
+
+    def add_item(self, item):
+        """追加接口响应中的一个数据项，timeseries 为空时打印警告后跳过"""
+        timeseries_data = item.get('timeseries')
+        if timeseries_data is not None:
+            self.add(item['tagCode'], timeseries_data)
+        else:
+            print(f"警告: tagCode {item['tagCode']} 的 timeseries 数据为空。")
+
+    def add_items(self, items):
+        """追加接口响应中的多个数据项"""
+        for item in items:
+            self.add_item(item)
+
+    def build(self, deduplicate=False):
+        """
+        构建合并后的 DataFrame。
+        :param deduplicate: 是否去掉 tagCode 和 time 都相同的重复点（如未拼接的时间片边界处）
+        :return: 包含 time（datetime）、tagValue（原始值）、tagCode（categorical）三列的 DataFrame
+        """
+        size = self.size
+        try:
+            times = pd.to_datetime(self.times[:size], format=self.time_format)
+        except ValueError:
+            print(f"警告: time 列与格式 {self.time_format} 不一致，改为自动推断格式解析。")
+            times = pd.to_datetime(self.times[:size], format='mixed')
+
+        # 分类按 tagCode 字母顺序排列，保证按 tagCode 排序的结果与字符串列一致
+        tags = np.array(list(self.tag_ids), dtype=object)
+        order = np.argsort(tags)
+        remap = np.empty(len(tags), dtype=np.int32)
+        remap[order] = np.arange(len(tags), dtype=np.int32)
+        tag_codes = pd.Categorical.from_codes(remap[self.codes[:size]], categories=tags[order])
+
+        df = pd.DataFrame({
+            'time': times,
+            'tagValue': self.values[:size],
+            'tagCode': tag_codes,
+        })
+        if deduplicate:
+            df = df.drop_duplicates(subset=['tagCode', 'time'], ignore_index=True)
+        return df
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+"""
+consumption_delta.py
+
+根据累计电量读数（tagValue）计算每个时间桶的用量（diff），替代 groupby('tagCode')['tagValue'].diff() 加全表 bfill：
+1. 每个 tagCode 的第一个时间桶没有前一个读数，用量记为 0，不再从下一行（甚至下一个 tag）回填；
+2. 读数变小时区分三种情况：
+   - 翻转（rollover）：只对配置了表计量程（rollover_value，全局或按 tagCode）的表计判断，前一个读数不低于量程的 90%
+     且当前读数低于量程的 10% 时视为翻转，用量 = 量程 - 前一个读数 + 当前读数；
+     没有配置量程的表计不做翻转判断（按读数推断量程会把换表、清零误判为翻转，产生虚高的用量）；
+   - 复位（reset）：当前读数不超过前一个读数的 reset_ratio 倍（如换表或清零），用量 = 当前读数；
+   - 其他回退视为读数抖动（glitch），用量记为 0，之后的用量从抖动前的最大读数开始计算；
+3. 相邻两个读数之间缺少时间桶时（缺口），将这段时间的用量按经过的时间桶数平均分摊到缺口中的每个时间桶，
+   并为缺失的时间桶补充 tagValue 为空的行，这些行和缺口后的第一行标记为 imputed；
+4. 传入 previous（如上一次运行存储的每个 tagCode 的最后一个读数）时，第一个时间桶的用量相对该读数计算，
+   而不是记为 0，增量运行的边界时间桶不会丢失用量；previous 本身不出现在结果中。
+所有计算对整个 DataFrame 一次性向量化完成，不逐个 tag 循环。
+"""
+
+# event 列的取值
+EVENTS = ['ok', 'first', 'gap', 'rollover', 'reset', 'glitch']
+
+
+def compute_consumption(df, granularity_minutes, rollover_value=None, reset_ratio=0.1, previous=None):
+    """
+    计算每个时间桶的用量。
+    :param df: resample_engine.resample_first 返回的长格式 DataFrame（time 已对齐到时间桶起点，包含 tagCode、tagValue 列）
+    :param granularity_minutes: 时间桶粒度（分钟）
+    :param rollover_value: 表计量程，超过后读数从 0 重新开始；可以是所有表计共用的一个数值，
+                           也可以是 {tagCode: 量程} 字典（未列出的 tagCode 不判断翻转）；None 表示不判断翻转
+    :param reset_ratio: 读数变小且当前读数不超过前一个读数的该比例时视为复位
+    :param previous: 每个 tagCode 在 df 之前的最后一个读数（包含 time、tagCode、tagValue 列，如 parquet_store.read_last_readings
+                     的结果），None 表示没有历史读数
+    :return: 按 tagCode、time 排序的 DataFrame，包含 time、tagValue、tagCode、diff（用量）、
+             imputed（是否为缺口分摊得到的用量）和 event（ok / first / gap / rollover / reset / glitch）列
+    """
+    step_ns = pd.Timedelta(minutes=granularity_minutes).value
+    df = df[['time', 'tagValue', 'tagCode']].assign(seed=False)
+    if previous is not None and len(previous):
+        # 历史读数只作为各 tag 的起点参与计算，计算后删除
+        df = pd.concat([previous[['time', 'tagValue', 'tagCode']].assign(seed=True), df], ignore_index=True)
+        df['tagCode'] = df['tagCode'].astype(str)
+    df = df.sort_values(by=['tagCode', 'time'], kind='stable', ignore_index=True)
+    seed = df['seed'].to_numpy()
+    tag_codes = pd.Categorical(df['tagCode'])
+    codes = tag_codes.codes
+    times = df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    values = df['tagValue'].to_numpy(dtype=np.float64)
+    count = len(df)
+
+    # 每个 tag 的第一行
+    first = np.ones(count, dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    prev_values = np.r_[np.nan, values[:-1]]
+    prev_times = np.r_[0, times[:-1]]
+
+    buckets = np.where(first, 1, np.maximum((times - prev_times) // step_ns, 1))
+    events = np.where(first, EVENTS.index('first'), EVENTS.index('ok'))
+
+    # 读数变小：翻转、复位或抖动
+    backwards = ~first & (values < prev_values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 没有配置量程的表计 capacity 为 NaN，比较结果均为 False，不会判断为翻转
+        if rollover_value is None:
+            capacity = np.full(count, np.nan)
+        elif isinstance(rollover_value, dict):
+            tag_capacity = pd.Series(rollover_value, dtype=np.float64).reindex(tag_codes.categories.astype(str))
+            capacity = tag_capacity.to_numpy()[codes]
+        else:
+            capacity = np.full(count, float(rollover_value))
+        rollover = backwards & (prev_values >= 0.9 * capacity) & (values < 0.1 * capacity)
+    reset = backwards & ~rollover & (values <= reset_ratio * prev_values)
+
+    # 翻转和复位之间的读数应单调不减，用量以此前的最大读数为基准，抖动回退的部分不会在回升时被重复计算
+    segments = np.cumsum(first | rollover | reset)
+    levels = pd.Series(values).groupby(segments).cummax().to_numpy()
+    prev_levels = np.r_[np.nan, levels[:-1]]
+    glitch = ~first & ~rollover & ~reset & (values < prev_levels)
+    delta = np.where(first | glitch, 0.0, values - prev_levels)
+    delta = np.where(rollover, capacity - prev_levels + values, delta)
+    delta = np.where(reset, values, delta)
+    events = np.where(rollover, EVENTS.index('rollover'), events)
+    events = np.where(reset, EVENTS.index('reset'), events)
+    events = np.where(glitch, EVENTS.index('glitch'), events)
+
+    # 缺口：每行展开为 buckets 行，前 buckets - 1 行为补充的时间桶，最后一行为原来的读数，用量平均分摊
+    gap = buckets > 1
+    events = np.where(gap & (events == EVENTS.index('ok')), EVENTS.index('gap'), events)
+    rows = np.repeat(np.arange(count), buckets)
+    position = np.arange(len(rows)) - np.repeat(np.cumsum(buckets) - buckets, buckets) + 1
+    original = position == buckets[rows]
+    keep = ~(original & seed[rows])
+    rows, position, original = rows[keep], position[keep], original[keep]
+
+    return pd.DataFrame({
+        'time': np.where(original, times[rows], prev_times[rows] + position * step_ns).view('datetime64[ns]'),
+        'tagValue': np.where(original, values[rows], np.nan),
+        'tagCode': pd.Categorical.from_codes(codes[rows], categories=tag_codes.categories),
+        'diff': delta[rows] / buckets[rows],
+        'imputed': gap[rows],
+        'event': pd.Categorical.from_codes(np.where(original, events[rows], EVENTS.index('gap')), categories=EVENTS),
+    })
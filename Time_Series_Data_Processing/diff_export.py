@@ -0,0 +1,73 @@
+import json
+import numpy as np
+import pandas as pd
+from api_fetcher import TIME_FORMAT
+
+"""
+diff_export.py
+
+将处理结果中的 diff 列导出为提供给其他模块的接口数据，替代逐行 iterrows 加逐行 strftime：
+1. build_diff_values 构建 {tagCode: {时间字符串: diff}} 字典：重采样后的时间只有少量不同的取值，
+   只对去重后的时间格式化一次，再按 tagCode 的分组边界切片，每个 tag 用 zip 一次性构建内层字典；
+2. write_diff_json 以同样的结构流式写出 JSON 文件，每次只在内存中保留一个 tag 的数据；
+3. write_diff_ndjson 每行写出一个数据点 {"tagCode": ..., "time": ..., "diff": ...}，按块批量序列化，适合大数据量和逐行读取。
+"""
+
+
+def _format_times(times, time_format):
+    """对去重后的时间统一格式化，返回与 times 等长的字符串数组"""
+    codes, uniques = pd.factorize(times)
+    return pd.DatetimeIndex(uniques).strftime(time_format).to_numpy(dtype=object)[codes]
+
+
+def iter_diff_values(df, time_format=TIME_FORMAT):
+    """
+    按 tagCode 逐个生成 (tagCode, {时间字符串: diff})。
+    :param df: 包含 tagCode、time、diff 列的 DataFrame
+    :param time_format: 时间字符串格式
+    """
+    if df.empty:
+        return
+    df = df.sort_values(by=['tagCode', 'time'], kind='stable')
+    tag_codes, tags = pd.factorize(df['tagCode'])
+    times = _format_times(df['time'], time_format)
+    diffs = df['diff'].to_numpy(dtype=np.float64)
+    # NaN 不是合法的 JSON 值，转换为 null
+    diffs = np.where(np.isnan(diffs), None, diffs).tolist()
+    bounds = np.flatnonzero(np.r_[True, tag_codes[1:] != tag_codes[:-1], True])
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        yield str(tags[tag_codes[begin]]), dict(zip(times[begin:end], diffs[begin:end]))
+
+
+def build_diff_values(df, time_format=TIME_FORMAT):
+    """构建 {tagCode: {时间字符串: diff}} 字典"""
+    return dict(iter_diff_values(df, time_format))
+
+
+def write_diff_json(df, path, time_format=TIME_FORMAT):
+    """以 {tagCode: {时间字符串: diff}} 的结构流式写出 JSON 文件"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        for number, (tagCode, values) in enumerate(iter_diff_values(df, time_format)):
+            if number:
+                f.write(', ')
+            f.write(json.dumps(tagCode, ensure_ascii=False))
+            f.write(': ')
+            f.write(json.dumps(values, ensure_ascii=False))
+        f.write('}')
+    print(f"diff_values 已保存到: {path}")
+
+
+def write_diff_ndjson(df, path, time_format=TIME_FORMAT, chunk_rows=100000):
+    """每行写出一个数据点 {"tagCode": ..., "time": ..., "diff": ...}，按 chunk_rows 行一块批量序列化"""
+    df = df.sort_values(by=['tagCode', 'time'], kind='stable')
+    with open(path, 'w', encoding='utf-8') as f:
+        for begin in range(0, len(df), chunk_rows):
+            chunk = df.iloc[begin:begin + chunk_rows]
+            records = pd.DataFrame({
+                'tagCode': chunk['tagCode'].astype(str),
+                'time': _format_times(chunk['time'], time_format),
+                'diff': chunk['diff'],
+            })
+            f.write(records.to_json(orient='records', lines=True, force_ascii=False, double_precision=15))
+    print(f"diff_values 已保存到: {path}")
@@ -0,0 +1,110 @@
+import os
+from openpyxl import Workbook
+
+"""
+exporter.py
+
+处理结果的导出工具，替代直接调用 DataFrame.to_excel：
+1. CSV、Parquet 为默认的导出格式，速度快，没有行数限制；
+2. Excel 仅作为可选的最终报表：使用 openpyxl 的 write_only 模式按块流式写入，内存占用与总行数无关；
+   超过单个工作表的行数上限（1048576 行，含表头）时自动拆分为多个工作表，
+   指定 max_sheets_per_file 时工作表数量超过上限后再拆分为多个文件。
+"""
+
+# Excel 单个工作表的最大行数（含表头）
+EXCEL_MAX_ROWS = 1048576
+# 支持的导出格式及对应的文件扩展名
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'excel': '.xlsx'}
+
+
+def _numbered_path(path, number):
+    """在文件名后追加编号，如 result.xlsx -> result_2.xlsx"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_{number}{ext}"
+
+
+def _excel_rows(df, chunk_rows):
+    """按块将 DataFrame 转换为 Excel 行，缺失值转换为空单元格（NaN 写入 Excel 会导致文件无法打开）"""
+    for begin in range(0, len(df), chunk_rows):
+        chunk = df.iloc[begin:begin + chunk_rows]
+        columns = [chunk[name].astype(object).where(chunk[name].notna(), None).to_numpy() for name in chunk.columns]
+        yield from zip(*columns)
+
+
+def write_excel(df, path, sheet_name='Sheet', max_rows=EXCEL_MAX_ROWS, max_sheets_per_file=None, chunk_rows=50000):
+    """
+    以流式方式将 DataFrame 写入 Excel 文件，超过行数上限时自动拆分工作表和文件。
+    :param df: 要写出的 DataFrame（不写出索引）
+    :param path: 输出文件路径；拆分为多个文件时依次为 path、path_2、path_3 ...
+    :param sheet_name: 工作表名称；拆分为多个工作表时依次为 sheet_name、sheet_name_2 ...
+    :param max_rows: 单个工作表的最大行数（含表头）
+    :param max_sheets_per_file: 单个文件的最大工作表数量，None 表示不拆分文件
+    :param chunk_rows: 每次转换的行数，决定写出过程中的内存占用
+    :return: 写出的文件路径列表
+    """
+    rows_per_sheet = max_rows - 1
+    header = [str(name) for name in df.columns]
+    paths = []
+    workbooks = []
+    sheets = []
+
+    def add_sheet():
+        """新建工作表，当前文件的工作表数量达到上限时先保存当前文件再新建文件"""
+        if not workbooks or (max_sheets_per_file is not None and len(workbooks[-1].worksheets) >= max_sheets_per_file):
+            if workbooks:
+                save()
+            workbooks.append(Workbook(write_only=True))
+            paths.append(path if not paths else _numbered_path(path, len(paths) + 1))
+        name = sheet_name if not sheets else f"{sheet_name}_{len(sheets) + 1}"
+        sheets.append(workbooks[-1].create_sheet(name))
+        sheets[-1].append(header)
+
+    def save():
+        workbooks[-1].save(paths[-1])
+        print(f"结果已保存到: {paths[-1]}")
+
+    for number, row in enumerate(_excel_rows(df, chunk_rows)):
+        if number % rows_per_sheet == 0:
+            add_sheet()
+        sheets[-1].append(row)
+    if not sheets:
+        add_sheet()  # 没有数据时只写出表头
+    save()
+    return paths
+
+
+def write_csv(df, path, chunk_rows=100000):
+    """将 DataFrame 写入 CSV 文件（utf-8-sig 编码，Excel 可直接打开）"""
+    df.to_csv(path, index=False, encoding='utf-8-sig', chunksize=chunk_rows)
+    print(f"结果已保存到: {path}")
+    return [path]
+
+
+def write_parquet(df, path):
+    """将 DataFrame 写入 Parquet 文件"""
+    df.to_parquet(path, index=False, compression='zstd')
+    print(f"结果已保存到: {path}")
+    return [path]
+
+
+def export_frame(df, base_path, formats=('csv',), **excel_options):
+    """
+    按指定格式导出 DataFrame。
+    :param df: 要导出的 DataFrame
+    :param base_path: 不含扩展名的输出路径，各格式自动追加对应的扩展名
+    :param formats: 导出格式，可选 'csv'、'parquet'、'excel'
+    :param excel_options: 传给 write_excel 的参数，如 sheet_name、max_sheets_per_file
+    :return: 写出的文件路径列表
+    """
+    paths = []
+    for export_format in formats:
+        if export_format not in EXTENSIONS:
+            raise ValueError(f"不支持的导出格式: {export_format}")
+        path = base_path + EXTENSIONS[export_format]
+        if export_format == 'csv':
+            paths += write_csv(df, path)
+        elif export_format == 'parquet':
+            paths += write_parquet(df, path)
+        else:
+            paths += write_excel(df, path, **excel_options)
+    return paths
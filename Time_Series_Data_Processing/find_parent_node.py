@@ -1,35 +1,41 @@
+import numpy as np
 import pandas as pd
+from exporter import write_excel
+
+"""
+find_parent_node.py
+
+生成 节点 -> 父节点 映射：某个单元格的父节点为其左侧各列中、当前行及以上最近的非空值，从紧邻的左侧列开始向左查找。
+先对所有列向下填充一次（得到每列在当前行及以上最近的非空值所在的行），再向右填充一次（得到左侧各列中从右数第一个有值的列），
+所有单元格的父节点都由这两次填充一次性得到，耗时与表格大小成线性关系，不再对每个单元格重新扫描该列之前的所有行。
+"""
 
 # 读取Excel文件
 excel_path = rf'../Time_Series_Data_Processing/data_inputs/电表结构化清单和名称映射.xlsx'
 df = pd.read_excel(excel_path)
 
-# 初始化结果字典
-result = []
-
 # 从LEVEL5开始，从右向左逐列遍历
-columns = ['LEVEL5', 'LEVEL4', 'LEVEL3', 'LEVEL2', 'LEVEL1', 'LEVEL1']
-
-for col in columns:
-    for idx, value in enumerate(df[col]):
-        if pd.isna(value):
-            continue
-
-        child_node = value
-        parent_node = None
+columns = ['LEVEL5', 'LEVEL4', 'LEVEL3', 'LEVEL2', 'LEVEL1']
 
-        # 从当前列的左侧列中寻找parent_node
-        for left_col in df.columns[df.columns.get_loc(col) - 1::-1]:
-            parent_candidates = df.loc[:idx, left_col]
-            parent_candidate = parent_candidates.dropna().iloc[-1:].values
-            if len(parent_candidate) > 0:
-                parent_node = parent_candidate[0]
-                break
+# last_rows[i, j]：第 j 列在第 i 行及以上最近的非空值所在的行，没有时为 -1
+cells = df.to_numpy(dtype=object)
+last_rows = np.maximum.accumulate(np.where(pd.notna(cells), np.arange(len(df))[:, None], -1), axis=0)
+# last_columns[i, j]：第 0 ~ j 列中，第 i 行及以上有非空值的最靠右的列，没有时为 -1
+last_columns = np.maximum.accumulate(np.where(last_rows >= 0, np.arange(len(df.columns)), -1), axis=1)
 
-        result.append({'node_name': child_node, 'parent_node_name': parent_node})
+result = []
+for col in columns:
+    position = df.columns.get_loc(col)
+    rows = np.flatnonzero(df[col].notna().to_numpy())
+    parents = np.full(len(rows), None, dtype=object)
+    # 当前列的父节点从紧邻的左侧列开始向左查找
+    if position > 0:
+        parent_columns = last_columns[rows, position - 1]
+        found = parent_columns >= 0
+        parents[found] = cells[last_rows[rows[found], parent_columns[found]], parent_columns[found]]
+    result.append(pd.DataFrame({'node_name': cells[rows, position], 'parent_node_name': parents}))
 
 # 将结果写入到新的Excel文件中
-result_df = pd.DataFrame(result)
+result_df = pd.concat(result, ignore_index=True)
 output_path = rf'../Time_Series_Data_Processing/data_inputs/节点父节点映射.xlsx'
-result_df.to_excel(output_path, index=False)
-
+write_excel(result_df, output_path, sheet_name='Sheet1')
@@ -1,53 +1,50 @@
 import os
-import requests
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import sys
 from tagCodes.tagcode_generator import generate_tagcodes
+from tagCodes.tagcode_registry import TagCodeRegistry
+from api_fetcher import BatchFetcher, FetchCheckpoint
+from adaptive_batching import AdaptiveBatchController
+from columnar_builder import ColumnarBuilder
+from tag_value_decoder import decode_tag_values, format_decode_summary
+from ts_cache import TimeSeriesCache, CachedFetcher, WatermarkStore, collect_incremental
+from parquet_store import write_store, read_store, read_last_readings
+from mmap_store import write_mmap_store
+from exporter import export_frame
+from resample_engine import resample_first
+from consumption_delta import compute_consumption
+from diff_export import build_diff_values, write_diff_json, write_diff_ndjson
+from rollup_cube import RollupCube, RollupStore
 
 """
 功能说明：
 该脚本用于从指定的 API 获取时间序列数据，然后对数据进行处理和分析，最后将结果保存为 Excel 文件和 JSON 格式。主要功能如下：
-1. 从 API 获取时间序列数据：通过指定的起始时间和结束时间，以及 tagCodes，向 API 发送请求以获取数据。
-2. 数据转换：对获取的数据进行转换，包括将布尔值转换为 1 或 0，将数值转换为浮点数，确保数据格式的一致性。
-3. 数据合并：将多个 tagCodes 的数据合并为一个 DataFrame，方便后续分析。
+1. 从 API 获取时间序列数据：通过指定的起始时间和结束时间，以及 tagCodes（可通过 tag_filter 按站点、建筑、设备类型等字段筛选），
+   使用 api_fetcher.BatchFetcher 并发分批请求数据；
+   启用 use_cache 时通过 ts_cache 只请求本地缓存中缺失的时间段；
+   启用 incremental 时只拉取每个 tagCode 上次水位线之后的新数据并追加到本地缓存。
+   失败的批次按指数退避重试，已完成的 (批次, 时间片) 写入检查点文件，中断后重新运行会从断点继续。
+2. 数据转换：合并后使用 tag_value_decoder 对 tagValue 列统一向量化解码，将布尔值转换为 1 或 0，将数值转换为浮点数，确保数据格式的一致性。
+3. 数据合并：通过 columnar_builder 将所有响应的数据点收集到列式缓冲区，一次性构建为一个 DataFrame，方便后续分析。
 4. 数据处理：
    - 按照 tagCode 和时间升序排列数据。
-   - 使用 pandas 的 resample 方法，按照指定的粒度（以分钟为单位）对数据进行重采样，删除多余的数据行。
-   - 计算每个粒度时间窗口的 tagValue 差值，并将结果添加到新的列中。
-5. 数据保存：将处理后的数据保存为 Excel 文件和 pickle 文件，以便后续使用和分析。
-6. diff 值的提取：将每个 tagCode 在时间序列中的 diff 值提取到一个字典中，并转换为 JSON 格式，便于进一步使用或传递给其他模块。
+   - 使用 resample_engine 按照指定的粒度（以分钟为单位）对所有 tag 一次性重采样，删除多余的数据行，同时得到 tag × 时间桶 的稠密矩阵。
+   - 使用 consumption_delta 计算每个粒度时间窗口的用量（diff 列），识别表计翻转、复位和读数回退，缺口中的用量按时间分摊并标记为 imputed。
+   - 使用 rollup_cube 由 diff 一次性汇总出 5 分钟、15 分钟、1 小时、1 天、1 个月各粒度的用量，由 RollupStore 按天分块保存。
+5. 数据保存：将处理后的数据写入按日期和站点前缀分区的 Parquet 存储（parquet_store），按粒度对齐的内存映射数组存储（mmap_store 和 mmap_store_diff，可选），
+   并通过 exporter 导出为 CSV / Parquet 文件（Excel 报表可选，超过行数上限时自动拆分工作表），以便后续使用和分析。
+6. diff 值的提取：通过 diff_export 将每个 tagCode 在时间序列中的 diff 值向量化地提取到一个字典中，并转换为 JSON 格式，
+   也可以流式写出为 JSON / NDJSON 文件，便于进一步使用或传递给其他模块。
 使用说明：
 - 确保安装所需的库，主要包括 requests、pandas 和 json。
-- 根据需求修改请求的 URL、时间范围、粒度（granularity_minutes）和批量请求大小（batch_size）等配置项。
+- 根据需求修改请求的 URL、时间范围、粒度（granularity_minutes）和批量请求大小（batch_size）、并发数（max_workers）等配置项。
 注意事项：
 - 在运行脚本之前，请确保网络连接正常（如不在内网，需要配置代理），以便能够成功访问 API。
 - 输出文件的路径可以根据实际需要进行调整。
 """
 
 
-# 处理 tagValue 列的转换函数，将布尔值转换为 1 或 0，将数值转换为浮点数
-def convert_tag_value(value):
-    if isinstance(value, str):
-        # 尝试将字符串转换为浮点数，如果成功则返回该浮点数
-        try:
-            return float(value)
-        except ValueError:
-            # 如果转换失败，继续判断是否为布尔值
-            if value.lower() == 'true':
-                return 1
-            elif value.lower() == 'false':
-                return 0
-            else:
-                return None  # 或者可以返回一个默认值，如 0
-
-    elif isinstance(value, bool):
-        return 1 if value else 0
-
-    return float(value)  # 默认将其他情况转换为 float
-
-
 # 设置请求的 URL
 url = 'http://10.86.6.3:8081/japrojecttag/timeseries'
 
@@ -56,70 +53,100 @@ start_time = "2025-03-28 00:00:00"
 end_time = "2025-03-28 00:11:00"
 granularity_minutes = 5
 tagCodes = generate_tagcodes()  # 从tagcode_generator.py 导入的函数，生成tagCodes列表
-# 用于存储所有 DataFrame 的列表
-all_data_frames = []
+# 按标签代码的字段筛选需要拉取的 tagCodes（如 {'site': 'SJ-A', 'device': 'Hvm', 'building': '20'}），None 表示全部
+tag_filter = None
+if tag_filter:
+    tagCodes = TagCodeRegistry(tagCodes).select(**tag_filter)
+    print(f"按 {tag_filter} 筛选出 {len(tagCodes)} 个 tagCode")
 # 设置每次批量请求的数据点数量
 batch_size = 5
+# 设置同时在途的批次数量
+max_workers = 8
+# 是否根据服务端响应耗时自动调整 batch_size 和并发数：启用时 batch_size 为初始值，max_workers 为并发上限
+adaptive = True
+# 设置长时间范围的切片长度（如 '6h'、'1d'），None 表示整个时间范围一次请求
+slice_size = None
+# 是否启用本地磁盘缓存：启用后只向 API 请求缓存中缺失的时间段
+use_cache = True
+cache_dir = "../Time_Series_Data_Processing/data_outputs/ts_cache"
+# 缓存的稳定时长：最近这段时间内的数据可能还有延迟入库的点，不标记为已缓存，下次运行时重新请求
+cache_settle = '10min'
+# 是否启用增量采集模式：每个 tagCode 只拉取从上次水位线到当前时间的数据，并追加到本地缓存；
+# 没有水位线的 tagCode 从 start_time 开始拉取，end_time 自动设为当前时间
+incremental = False
+watermark_file = "../Time_Series_Data_Processing/data_outputs/watermarks.json"
+# 是否以流的方式增量解析响应：不启用缓存和增量采集时，数据项会边解析边写入列式缓冲区
+streaming = True
+# 检查点文件：记录已完成的 (批次, 时间片) 及其数据，程序中断后重新运行会从断点继续，全部成功后自动删除
+checkpoint_file = "../Time_Series_Data_Processing/data_outputs/fetch_checkpoint.jsonl"
+# 单个批次的超时时间（秒）和失败后的最大重试次数
+request_timeout = 60
+max_retries = 3
+# 处理结果的 Parquet 存储目录（按 site=站点前缀/date=日期 分区），tree.py 等下游脚本从这里按需读取
+store_dir = "../Time_Series_Data_Processing/data_outputs/parquet_store"
+# 计算用量时，从 Parquet 存储中向前查找每个 tagCode 上一次运行的最后一个读数的最大时长，
+# 本次第一个时间桶的用量相对该读数计算（增量运行的边界时间桶不会记为 0），None 表示不衔接
+seed_lookback = '1d'
+# 表计量程：读数超过量程后从 0 重新开始（翻转），可以是所有表计共用的数值或 {tagCode: 量程} 字典；
+# 只有配置了量程的表计才判断翻转，None 表示都不判断，读数大幅变小时按复位处理
+meter_capacity = None
+# 按粒度对齐的内存映射数组存储目录，供跨越数月的大时间范围分析按窗口零拷贝读取，None 表示不写出
+mmap_dir = "../Time_Series_Data_Processing/data_outputs/mmap_store"
+# consumption_delta 计算的用量（diff 列）的内存映射存储目录，与 mmap_dir 按相同的时间轴对齐，None 表示不写出
+mmap_diff_dir = "../Time_Series_Data_Processing/data_outputs/mmap_store_diff"
+# 结果文件的导出格式，可选 'csv'、'parquet'、'excel'；Excel 写出较慢，仅在需要最终报表时加入
+export_formats = ['csv']
+# diff_values 接口文件的格式：'json' 为 {tagCode: {时间: diff}}，'ndjson' 为每行一个数据点，None 表示不写出
+diff_values_format = None
+# 多粒度用量汇总（5 分钟、15 分钟、1 小时、1 天、1 个月）的保存目录（按天分块），报表可直接从中查表，None 表示不生成
+rollup_dir = "../Time_Series_Data_Processing/data_outputs/rollup_store"
+
+# 将所有响应中的 time / tagValue 收集到列式缓冲区，最后一次性构建合并后的 DataFrame
+builder = ColumnarBuilder()
+
+checkpoint = FetchCheckpoint(checkpoint_file)
+controller = AdaptiveBatchController(batch_size=batch_size, max_concurrency=max_workers,
+                                    timeout=request_timeout) if adaptive else None
+# 流式交付时各时间片不拼接，且中途失败重试会重复交付，构建时需要去重
+deduplicate = False
+
+# 并发请求所有 (批次 × 时间片)，按 tagCodes 的顺序返回每个 tag 的响应项
+with BatchFetcher(url, batch_size=batch_size, max_workers=max_workers, slice_size=slice_size,
+                  streaming=streaming, timeout=request_timeout, max_retries=max_retries,
+                  checkpoint=checkpoint, controller=controller) as fetcher:
+    if incremental:
+        end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        items = collect_incremental(fetcher, TimeSeriesCache(cache_dir, settle=cache_settle),
+                                    WatermarkStore(watermark_file), tagCodes, start_time, end_time,
+                                    align=f'{granularity_minutes}min')
+    elif use_cache:
+        # 已缓存的时间段直接从磁盘读取，只请求缺口部分
+        items = CachedFetcher(fetcher, TimeSeriesCache(cache_dir, settle=cache_settle)).fetch(tagCodes, start_time,
+                                                                                          end_time)
+    elif streaming:
+        # 边解析边写入列式缓冲区，不在内存中保留完整响应
+        items = []
+        deduplicate = True
+        fetcher.fetch_stream(tagCodes, start_time, end_time, builder.add_item)
+    else:
+        items = fetcher.fetch(tagCodes, start_time, end_time)
 
-# 循环遍历 tagCodes，分批请求数据
-for i in range(0, len(tagCodes), batch_size):
-    batch_tagCodes = tagCodes[i:i + batch_size]
-    # 创建请求体
-    data = {
-        "tagCodes": batch_tagCodes,
-        "startTime": start_time,
-        "endTime": end_time
-    }
-    # 发送 POST 请求
-    response = requests.post(url, json=data)
-    print(response)
-    # 检查请求是否成功，如果不成功，打印错误信息并继续下一次循环
-    if response.status_code == 200:
-        # 解析 JSON 数据
-        json_data = response.json()
-        print(f"请求成功，响应：{json_data}")
-        # print(json_data)
-        # 检查 'data' 是否存在且是列表
-        if json_data and 'data' in json_data and isinstance(json_data['data'], list):
-            # 遍历数据列表
-            for item in json_data['data']:
-                timeseries_data = item.get('timeseries')
-                # 确保 timeseries_data 不是 None
-                if timeseries_data is not None:
-                    # 将数据转换为 DataFrame
-                    df = pd.DataFrame(timeseries_data)
-                    # 使用转换函数处理 tagValue 列（如果是布尔值，则转换为 1 或 0，如果是数值，则转换为浮点数）
-                    df['tagValue'] = df['tagValue'].apply(convert_tag_value)  # 使用自定义函数处理 tagValue
-                    # 转换 time 列为 datetime
-                    df['time'] = pd.to_datetime(df['time'])
-                    # 添加 tagCode 列
-                    df['tagCode'] = item['tagCode']  # 使用当前 item 的 tagCode
-
-                    # 添加到总的 DataFrame 列表中
-                    all_data_frames.append(df)
-                else:
-                    print(f"警告: tagCode {item['tagCode']} 的 timeseries 数据为空。")
-        else:
-            print(f"警告: 响应格式不正确或数据为空。")
+    if fetcher.failed_units:
+        print(f"有 {len(fetcher.failed_units)} 个批次失败，保留检查点 {checkpoint_file}，重新运行脚本即可继续。")
+        checkpoint.close()
     else:
-        print(f"请求失败，状态码: {response.status_code}, 响应：{response.text}")
-
-# 合并所有 DataFrame
-if all_data_frames:
-    combined_df = pd.concat(all_data_frames, ignore_index=True)
-    # filepath_combined_df = r"../Time_Series_Data_Processing/data_outputs/combined1.xlsx"
-    # combined_df.to_excel(filepath_combined_df)
-    # 验证 tagValue 列的每个值是否为 float
-    is_float = combined_df['tagValue'].apply(lambda x: isinstance(x, float))
-    # 把combined_df保存到excel文件
-    # combined_df.to_excel("combined.xlsx")
-    # 打印非 float 的值
-    not_float_values = combined_df.loc[~is_float, 'tagValue']
-    print("不是 float 的值有：")
-    print(not_float_values)
+        checkpoint.clear()
+
+builder.add_items(items)
+combined_df = builder.build(deduplicate=deduplicate)
+
+if not combined_df.empty:
+    # 对合并后的 tagValue 列统一做一次向量化解码（布尔值转换为 1 或 0，数值转换为浮点数）
+    combined_df['tagValue'], decode_summary = decode_tag_values(combined_df['tagValue'])
+    # 只打印无法解码的数量和示例
+    print(format_decode_summary(decode_summary))
 else:
     print("没有可合并的数据。")
-    combined_df = pd.DataFrame()  # 为了后续代码安全，初始化为空的DataFrame
 
 # 1）按照 tagCode 列和 time 列升序排列
 combined_df.sort_values(by=['tagCode', 'time'], inplace=True)
@@ -128,59 +155,58 @@ combined_df.sort_values(by=['tagCode', 'time'], inplace=True)
 if not combined_df.empty:
     combined_df['time'] = combined_df['time'].dt.floor('min')
 
-# 3) 使用pandas的groupby和resample方法，按照每个tagCode的granularity_minutes的分钟粒度，删除多余的行
-if not combined_df.empty:
-    # 设置时间列为索引
-    combined_df.set_index('time', inplace=True)
-
-    # 按tagCode分组并重新采样
-    combined_cut_df = (combined_df.groupby('tagCode')
-                       .resample(f'{granularity_minutes}min')
-                       .first()
-                       .droplevel(0))  # 移除最外层的索引（即tagCode），仅保留时间索引
-
-    # 重置索引，将'time'转回列
-    combined_cut_df.reset_index(inplace=True)
-
-    print("combined_cut_df=\n", combined_cut_df)
-
-# 4) 在combined_cut_df的基础上，计算每granularity_minutes分钟的差值diff，并添加到combined_cut_df的新列diff
-combined_cut_df['diff'] = combined_cut_df.groupby('tagCode')['tagValue'].diff()
-
-# print("combined_cut_df after diff calculation=\n", combined_cut_df)
-
-# 5）利用fillna方法填充第一行的NaN值
-combined_cut_df.bfill(inplace=True)
+# 3) 使用 resample_engine 按 granularity_minutes 的分钟粒度重采样：每个 tagCode 在每个时间桶内取第一个数据点，删除多余的行
+# resampled_matrix 为 (时间轴, tagCode 列表, tag × 时间桶 的稠密矩阵)，没有数据的位置为 NaN
+combined_cut_df, resampled_matrix = resample_first(combined_df, granularity_minutes)
+print("combined_cut_df=\n", combined_cut_df)
+
+# 4) 在combined_cut_df的基础上，使用 consumption_delta 计算每granularity_minutes分钟的用量diff：
+# 每个 tagCode 的第一个时间桶相对存储中此前的最后一个读数计算（没有时记为 0），识别表计翻转（仅限配置了量程的表计）和复位，
+# 缺口中的用量按时间分摊并补充缺失的时间桶（imputed 列标记）
+previous_readings = None
+if seed_lookback is not None and not combined_cut_df.empty:
+    first_times = combined_cut_df.groupby('tagCode', observed=True)['time'].min()
+    previous_readings = read_last_readings(store_dir, {str(tag): time for tag, time in first_times.items()},
+                                           lookback=seed_lookback)
+combined_cut_df = compute_consumption(combined_cut_df, granularity_minutes, rollover_value=meter_capacity,
+                                      previous=previous_readings)
+imputed_count = int(combined_cut_df['imputed'].sum())
+event_counts = combined_cut_df['event'].value_counts()
+print(f"用量计算: 分摊缺口 {imputed_count} 个时间桶，翻转 {event_counts['rollover']} 次，"
+      f"复位 {event_counts['reset']} 次，读数回退 {event_counts['glitch']} 次")
 # print("final combined_cut_df=\n", combined_cut_df)
 
 # 获取当前时间戳
 current_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-# 定义输出文件的路径
-output_file_path = f"../Time_Series_Data_Processing/data_outputs/按颗粒度{granularity_minutes}min筛选的原始数据_{current_timestamp}.xlsx"
-filepath_combined_cut_df = f"../Time_Series_Data_Processing/data_outputs/combined_cut_df.pkl"
-# 保存DataFrame
-combined_cut_df.to_pickle(filepath_combined_cut_df)
-
-# 保存结果到 Excel 文件
-combined_cut_df.to_excel(output_file_path)
-print(f"结果已保存到: {output_file_path}")
-
-# 在计算diff值之后，定义diff_values字典
-diff_values = {}
-
-# 遍历combined_cut_df，填充diff_values字典
-for index, row in combined_cut_df.iterrows():
-    tag_code = row['tagCode']
-    timestamp = row['time'].strftime('%Y-%m-%d %H:%M:%S')  # 将时间转换为字符串
-    diff_value = row['diff']
-
-    # 确保tagCode在字典中
-    if tag_code not in diff_values:
-        diff_values[tag_code] = {}
-
-    # 将diff值添加到时间戳的字典中
-    diff_values[tag_code][timestamp] = diff_value
+# 定义输出文件的路径（不含扩展名，按导出格式追加）
+output_file_path = f"../Time_Series_Data_Processing/data_outputs/按颗粒度{granularity_minutes}min筛选的原始数据_{current_timestamp}"
+# 写入 Parquet 存储，已存在的分区与本次结果合并
+partition_count = write_store(combined_cut_df, store_dir)
+print(f"结果已写入 Parquet 存储: {store_dir}（{partition_count} 个分区）")
+if mmap_dir is not None and not combined_cut_df.empty:
+    tag_count = write_mmap_store(combined_cut_df, mmap_dir, granularity_minutes)
+    print(f"结果已写入内存映射存储: {mmap_dir}（{tag_count} 个 tagCode）")
+if mmap_diff_dir is not None and not combined_cut_df.empty:
+    tag_count = write_mmap_store(combined_cut_df, mmap_diff_dir, granularity_minutes, value_column='diff')
+    print(f"用量已写入内存映射存储: {mmap_diff_dir}（{tag_count} 个 tagCode）")
+
+# 5) 由 diff 一次性汇总出各粒度的用量（每一级由更细的一级求和得到）：
+# 本次涉及的 tagCode 和日期从 Parquet 存储中读取整天的数据重新汇总，只重写这些天和所在月份的分块，其他分块保持不变
+if rollup_dir is not None and not combined_cut_df.empty:
+    affected_df = read_store(store_dir, columns=['time', 'tagCode', 'diff'],
+                             start_time=combined_cut_df['time'].min().normalize(),
+                             end_time=combined_cut_df['time'].max().normalize() + timedelta(days=1, microseconds=-1),
+                             tagCodes=combined_cut_df['tagCode'].astype(str).unique())
+    rollup_cube = RollupCube.from_frame(affected_df, granularity_minutes)
+    day_count = RollupStore(rollup_dir).write(rollup_cube)
+    print(f"多粒度用量汇总已保存到: {rollup_dir}（{', '.join(rollup_cube.levels)}，更新 {day_count} 天）")
+
+# 按配置的格式导出结果文件
+export_frame(combined_cut_df, output_file_path, formats=export_formats)
+
+# 在计算diff值之后，构建diff_values字典 {tagCode: {时间: diff}}（对去重后的时间统一格式化，按 tagCode 分组切片构建）
+diff_values = build_diff_values(combined_cut_df)
 
 # 计算diff值之和
 diff_sum = combined_cut_df['diff'].sum()
@@ -195,9 +221,11 @@ print("="*50 + "\n")
 
 # 转换为JSON格式
 diff_values_json = json.dumps(diff_values, ensure_ascii=False)
-# 保存为txt文件
-# with open('diff_values.txt', 'w', encoding='utf-8') as f:
-#     f.write(diff_values_json)
+# 以流式方式保存为文件供其他模块读取
+if diff_values_format == 'json':
+    write_diff_json(combined_cut_df, f"{output_file_path}_diff_values.json")
+elif diff_values_format == 'ndjson':
+    write_diff_ndjson(combined_cut_df, f"{output_file_path}_diff_values.ndjson")
 # 输出JSON格式的diff_values
 # print("diff_values (JSON格式):", diff_values_json)
 
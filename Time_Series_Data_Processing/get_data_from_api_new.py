@@ -1,10 +1,11 @@
 import os
-import requests
-import pandas as pd
 from datetime import datetime
-import json
 import sys
 from tagCodes.tagcode_generator import generate_tagcodes
+from api_fetcher import BatchFetcher
+from columnar_builder import ColumnarBuilder
+from tag_value_decoder import decode_tag_values, format_decode_summary
+from exporter import export_frame
 
 # 设置请求的 URL
 url = 'http://10.86.6.3:8081/japrojecttag/timeseries'
@@ -13,49 +14,31 @@ url = 'http://10.86.6.3:8081/japrojecttag/timeseries'
 start_time = "2025-03-28 00:00:00"
 end_time = "2025-03-28 01:01:00"
 batch_size = 30
+max_workers = 8  # 同时在途的批次数量
+slice_size = None  # 时间片长度（如 '6h'、'1d'），None 表示不切分
 tagCodes = generate_tagcodes()  # 从tagcode_generator.py 导入的函数，生成tagCodes列表
+# 导出格式，可选 'csv'、'parquet'、'excel'；所有 tag 写入同一个文件，Excel 超过行数上限时自动拆分工作表
+export_formats = ['csv']
 
-# 循环遍历 tagCodes，分批请求数据
-for i in range(0, len(tagCodes), batch_size):
-    batch_tagCodes = tagCodes[i:i + batch_size]
-    # 创建请求体
-    data = {
-        "tagCodes": batch_tagCodes,
-        "startTime": start_time,
-        "endTime": end_time
-    }
-    # 发送 POST 请求
-    response = requests.post(url, json=data)
-    print(response)
-
-    # 检查请求是否成功，如果不成功，打印错误信息并继续下一次循环
-    if response.status_code == 200:
-        # 解析 JSON 数据
-        json_data = response.json()
-        print(f"请求成功，响应：{json_data}")
-
-        # 检查 'data' 是否存在且是列表
-        if json_data and 'data' in json_data and isinstance(json_data['data'], list):
-            # 遍历数据列表
-            for item in json_data['data']:
-                timeseries_data = item.get('timeseries')
-                # 确保 timeseries_data 不是 None
-                if timeseries_data is not None:
-                    # 将数据转换为 DataFrame
-                    df = pd.DataFrame(timeseries_data)
-
-                    # 获取当前时间戳
-                    current_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-                    # 定义输出文件的路径
-                    output_file_path = f"{item['tagCode']}_{current_timestamp}.xlsx"
-
-                    # 保存DataFrame到Excel文件
-                    df.to_excel(output_file_path, index=False)
-                    print(f"结果已保存到: {output_file_path}")
-                else:
-                    print(f"警告: tagCode {item['tagCode']} 的 timeseries 数据为空。")
-        else:
-            print(f"警告: 响应格式不正确或数据为空。")
-    else:
-        print(f"请求失败，状态码: {response.status_code}, 响应：{response.text}")
+# 边解析边写入列式缓冲区
+builder = ColumnarBuilder()
+
+# 并发请求所有 (批次 × 时间片)，各 tag 的数据项解析后立即写入缓冲区
+with BatchFetcher(url, batch_size=batch_size, max_workers=max_workers, slice_size=slice_size,
+                  streaming=True) as fetcher:
+    fetcher.fetch_stream(tagCodes, start_time, end_time, builder.add_item)
+
+df = builder.build(deduplicate=True)
+if not df.empty:
+    df['tagValue'], decode_summary = decode_tag_values(df['tagValue'])
+    print(format_decode_summary(decode_summary))
+df = df.sort_values(by=['tagCode', 'time'], ignore_index=True)[['tagCode', 'time', 'tagValue']]
+
+# 获取当前时间戳
+current_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+# 定义输出文件的路径（不含扩展名，按导出格式追加）
+output_file_path = f"原始数据_{current_timestamp}"
+
+# 所有 tag 的数据导出到同一个文件
+export_frame(df, output_file_path, formats=export_formats, sheet_name='原始数据')
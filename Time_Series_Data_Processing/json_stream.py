@@ -0,0 +1,91 @@
+import re
+import json
+import codecs
+
+"""
+json_stream.py
+
+从响应字节流中增量解析 JSON 顶层对象里某个数组字段（默认为 data）的元素，
+每解析出一个完整元素就立即交给调用方，不需要先把整个响应体读入并解码为嵌套的 dict。
+内存占用只与单个元素（一个 tag 的 timeseries）和读取缓冲区的大小有关，与请求的时间范围无关。
+"""
+
+# 空白字符和数组元素之间的逗号
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_array_items(chunks, key='data', required=False):
+    """
+    增量解析 {"...": ..., "<key>": [item, item, ...], ...} 中 key 数组的元素。
+    :param chunks: 字节块的可迭代对象，例如 response.iter_content(chunk_size)
+    :param key: 要解析的数组字段名
+    :param required: 为 True 时字段不存在或为 null 抛出 ValueError
+    :return: 逐个返回数组元素的生成器；字段不存在或为 null 时不返回任何元素（required 为 True 时抛出异常）
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    key_pattern = re.compile(r'"%s"\s*:\s*' % re.escape(key))
+    buffer = ''
+    pos = 0
+    exhausted = False
+
+    def read_more():
+        """读取下一个字节块追加到缓冲区，同时丢弃已解析的部分；数据读完时返回 False"""
+        nonlocal buffer, pos, exhausted
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[pos:] + text_decoder.decode(chunk)
+                pos = 0
+                return True
+        buffer = buffer[pos:] + text_decoder.decode(b'', final=True)
+        pos = 0
+        exhausted = True
+        return False
+
+    # 1. 定位 "key": 之后的位置
+    while True:
+        match = key_pattern.search(buffer, pos)
+        if match and match.end() < len(buffer):
+            pos = match.end()
+            break
+        if exhausted:
+            if required:
+                raise ValueError(f"响应中没有 {key} 字段")
+            return
+        # 保留已匹配部分或末尾一小段，防止字段名被截断在两个字节块之间
+        pos = match.start() if match else max(pos, len(buffer) - len(key) - 16)
+        read_more()
+
+    # 确保能判断字段值是 [ 还是 null
+    while len(buffer) - pos < 4 and read_more():
+        pass
+    if buffer.startswith('null', pos):
+        if required:
+            raise ValueError(f"响应中的 {key} 字段为 null")
+        return
+    if buffer[pos] != '[':
+        raise ValueError(f"字段 {key} 不是数组")
+    pos += 1
+
+    # 2. 逐个解析数组元素
+    while True:
+        pos = SEPARATORS.match(buffer, pos).end()
+        if pos >= len(buffer):
+            if not read_more() and not buffer:
+                raise ValueError("响应数据不完整")
+            continue
+        if buffer[pos] == ']':
+            return
+
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if exhausted:
+                raise ValueError("响应数据不完整")
+            # 元素尚未读完整：至少读到缓冲区翻倍后再重试，避免大元素被反复从头解析
+            target = 2 * (len(buffer) - pos)
+            while len(buffer) - pos < target and read_more():
+                pass
+            continue
+        yield item
@@ -0,0 +1,227 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+"""
+mmap_store.py
+
+按固定步长（重采样粒度）对齐的内存映射数组存储，用于跨越数月的大时间范围分析：
+    store_dir/
+        values/
+            <tagCode>.f64  每个 tag 一个 float64 数组文件，缺失的时间点为 NaN
+        index.json         步长，以及每个 tagCode 的数组文件、起始时间和点数
+
+第 i 个 tag 的第 k 个点对应时间 start + k * step，因此按时间窗口读取只需计算下标，
+返回的是内存映射文件上的切片视图，不做任何反序列化和复制，也不会把整个文件读入内存。
+打开存储只读取 index.json，600 个电表一年的 5 分钟数据也可以立即打开。
+每次写入与已有的存储按 tag 合并：新数据在 tag 已有范围之后时只在该 tag 的文件末尾追加，范围内的点原地覆盖，
+不重写已有的数据（只有新数据早于已有的起始时间时才重写该 tag 的文件），增量运行的写入量只与新数据量有关。
+index.json 最后写入，写入中途中断时按旧的索引读取，已有的数据仍然有效。
+可以为不同的数值列分别建立存储（如 tagValue 和 consumption_delta 计算的 diff 各一个目录）。
+
+旧版本的存储（所有 tag 首尾相接存放在一个 values.f64 中）仍可读取，下一次写入时拆分为每个 tag 一个文件。
+"""
+
+VALUES_DIR = 'values'
+# 旧版本存储中所有 tag 共用的数组文件
+VALUES_FILE = 'values.f64'
+INDEX_FILE = 'index.json'
+
+
+def _read_index(store_dir):
+    """
+    读取 index.json。
+    :return: (步长, {tagCode: (数组文件相对路径, 偏移量, 起始时间, 点数)})，存储不存在时返回 (None, {})
+    """
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None, {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    entries = {
+        tag: (entry.get('file', VALUES_FILE), entry.get('offset', 0), pd.Timestamp(entry['start']), entry['length'])
+        for tag, entry in index['tags'].items()
+    }
+    return pd.Timedelta(index['step']), entries
+
+
+def _write_index(store_dir, granularity_minutes, entries):
+    index = {
+        'step': f'{granularity_minutes}min',
+        'tags': {
+            tag: {'file': file, 'offset': int(offset), 'start': start.strftime('%Y-%m-%d %H:%M:%S'),
+                  'length': int(length)}
+            for tag, (file, offset, start, length) in sorted(entries.items())
+        },
+    }
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(index_path + '.tmp', index_path)
+
+
+def _write_tag_file(path, values):
+    """整体写入一个 tag 的数组文件（先写临时文件再替换）"""
+    values.astype(np.float64).tofile(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def _split_legacy(store_dir, entries):
+    """将旧版本共用 values.f64 中的各 tag 拆分为独立文件，返回更新后的索引项"""
+    legacy_path = os.path.join(store_dir, VALUES_FILE)
+    legacy = np.memmap(legacy_path, dtype=np.float64, mode='r')
+    result = {}
+    for tag, (file, offset, start, length) in entries.items():
+        if file == VALUES_FILE:
+            file = f'{VALUES_DIR}/{tag}.f64'
+            _write_tag_file(os.path.join(store_dir, file), np.asarray(legacy[offset:offset + length]))
+            offset = 0
+        result[tag] = (file, offset, start, length)
+    del legacy
+    return result
+
+
+def write_mmap_store(df, store_dir, granularity_minutes, value_column='tagValue'):
+    """
+    将重采样后的数据合并写入内存映射存储。
+    已存在的存储按 tag 合并：每个 tag 的时间范围扩展为已有范围与本次数据的并集，本次没有的 tag 原样保留，
+    同一时间点以本次的非空值为准（本次为 NaN 的点保留已有的值）。
+    :param df: 包含 time（已按粒度对齐的 datetime）、tagCode 和 value_column 列的 DataFrame
+    :param store_dir: 存储目录，不存在时自动创建
+    :param granularity_minutes: 步长（分钟），与重采样粒度一致，需与已存在的存储相同
+    :param value_column: 写入的数值列
+    :return: 本次写入的 tag 数量
+    """
+    os.makedirs(os.path.join(store_dir, VALUES_DIR), exist_ok=True)
+    step = pd.Timedelta(minutes=granularity_minutes)
+    existing_step, entries = _read_index(store_dir)
+    if existing_step is not None and existing_step != step:
+        raise ValueError(f"内存映射存储 {store_dir} 的步长为 {existing_step // pd.Timedelta(minutes=1)} 分钟，"
+                         f"与本次的 {granularity_minutes} 分钟不一致，请使用其他目录")
+    if any(file == VALUES_FILE for file, _, _, _ in entries.values()):
+        entries = _split_legacy(store_dir, entries)
+        _write_index(store_dir, granularity_minutes, entries)
+        os.remove(os.path.join(store_dir, VALUES_FILE))
+
+    df = df.dropna(subset=['time', value_column])
+    step_ns = step.value
+    tag_codes, tags = pd.factorize(df['tagCode'], sort=True)
+    times = df['time'].dt.floor(step).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    values = df[value_column].to_numpy(dtype=np.float64)
+    order = np.argsort(tag_codes, kind='stable')
+    bounds = np.searchsorted(tag_codes[order], np.arange(len(tags) + 1))
+
+    for code, tag in enumerate(tags):
+        tag = str(tag)
+        rows = order[bounds[code]:bounds[code + 1]]
+        tag_times, tag_values = times[rows], values[rows]
+        start, end = int(tag_times.min()), int(tag_times.max())
+        file = f'{VALUES_DIR}/{tag}.f64'
+        path = os.path.join(store_dir, file)
+        if tag in entries:
+            _, _, old_start, old_length = entries[tag]
+            old_start = old_start.value
+            end = max(end, old_start + (old_length - 1) * step_ns)
+            if start < old_start:
+                # 新数据早于已有的起始时间：重写该 tag 的文件，已有数据后移
+                length = (end - start) // step_ns + 1
+                merged = np.full(length, np.nan)
+                shift = (old_start - start) // step_ns
+                merged[shift:shift + old_length] = np.fromfile(path, dtype=np.float64, count=old_length)
+                _write_tag_file(path, merged)
+                # 已有数据的下标已经改变，立即更新索引，避免中断后按旧的起始时间读取
+                entries[tag] = (file, 0, pd.Timestamp(start), length)
+                _write_index(store_dir, granularity_minutes, entries)
+            else:
+                start = old_start
+                length = (end - start) // step_ns + 1
+                if length > old_length:
+                    # 只在文件末尾追加新增部分（先填充 NaN，再写入数据）
+                    with open(path, 'r+b') as f:
+                        f.truncate(old_length * 8)
+                        f.seek(old_length * 8)
+                        f.write(np.full(length - old_length, np.nan).tobytes())
+        else:
+            length = (end - start) // step_ns + 1
+            _write_tag_file(path, np.full(length, np.nan))
+
+        array = np.memmap(path, dtype=np.float64, mode='r+', shape=(length,))
+        array[(tag_times - start) // step_ns] = tag_values
+        array.flush()
+        del array
+        entries[tag] = (file, 0, pd.Timestamp(start), length)
+
+    _write_index(store_dir, granularity_minutes, entries)
+    return len(tags)
+
+
+class MmapSeriesStore:
+    def __init__(self, store_dir):
+        """
+        以只读方式打开内存映射存储。
+        :param store_dir: write_mmap_store 写出的存储目录
+        """
+        self.store_dir = store_dir
+        self.step, self.index = _read_index(store_dir)
+        if self.step is None:
+            raise FileNotFoundError(f"内存映射存储不存在: {store_dir}")
+        self.files = {}  # 已映射的数组文件，首次读取某个 tag 时才映射
+
+    def _values(self, file):
+        if file not in self.files:
+            self.files[file] = np.memmap(os.path.join(self.store_dir, file), dtype=np.float64, mode='r')
+        return self.files[file]
+
+    @property
+    def tagCodes(self):
+        return list(self.index)
+
+    def time_range(self, tagCode=None):
+        """返回 (起始时间, 截止时间)，不指定 tagCode 时为所有 tag 的并集"""
+        entries = [self.index[tagCode]] if tagCode is not None else self.index.values()
+        starts = [start for _, _, start, length in entries]
+        ends = [start + (length - 1) * self.step for _, _, start, length in entries]
+        return min(starts), max(ends)
+
+    def _slice(self, tagCode, start_time, end_time):
+        """计算时间窗口在数组文件中的下标范围，返回 (首个点的时间, 数组文件, 起始下标, 截止下标)"""
+        file, offset, start, length = self.index[tagCode]
+        first = 0
+        last = length
+        if start_time is not None:
+            first = int(np.clip(-((start - pd.Timestamp(start_time)) // self.step), 0, length))
+        if end_time is not None:
+            last = int(np.clip((pd.Timestamp(end_time) - start) // self.step + 1, first, length))
+        return start + first * self.step, file, offset + first, offset + last
+
+    def window(self, tagCode, start_time=None, end_time=None):
+        """
+        读取一个 tag 在 [start_time, end_time] 内的数据。
+        :return: (首个点的时间, 数组视图)，第 k 个点的时间为 首个点的时间 + k * step；数组为只读视图，不复制数据
+        """
+        first_time, file, first, last = self._slice(tagCode, start_time, end_time)
+        return first_time, self._values(file)[first:last]
+
+    def series(self, tagCode, start_time=None, end_time=None):
+        """以时间为索引的 Series 形式读取一个 tag 的数据"""
+        first_time, values = self.window(tagCode, start_time, end_time)
+        index = pd.date_range(first_time, periods=len(values), freq=self.step, name='time')
+        return pd.Series(values, index=index, name=tagCode, copy=False)
+
+    def matrix(self, tagCodes=None, start_time=None, end_time=None):
+        """
+        将多个 tag 对齐到同一时间轴，返回 tag × 时间 的二维数组（会复制数据）。
+        :return: (时间轴 DatetimeIndex, tagCode 列表, 二维数组)，没有数据的位置为 NaN
+        """
+        tagCodes = self.tagCodes if tagCodes is None else list(tagCodes)
+        range_start, range_end = self.time_range()
+        start = pd.Timestamp(start_time) if start_time is not None else range_start
+        end = pd.Timestamp(end_time) if end_time is not None else range_end
+        axis = pd.date_range(start.ceil(self.step), end, freq=self.step, name='time')
+        result = np.full((len(tagCodes), len(axis)), np.nan)
+        for row, tagCode in enumerate(tagCodes):
+            first_time, values = self.window(tagCode, start, end)
+            column = (first_time - axis[0]) // self.step if len(axis) else 0
+            result[row, column:column + len(values)] = values
+        return axis, tagCodes, result
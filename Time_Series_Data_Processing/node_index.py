@@ -0,0 +1,117 @@
+import re
+import bisect
+from rapidfuzz import fuzz, process
+
+"""
+node_index.py
+
+电表树的节点索引，按节点名称和数据点编码（tagCode）查找节点，并返回节点在树中的路径：
+1. exact：名称或 tagCode 完全相同（不区分大小写），字典查找；
+2. prefix：以输入开头，在排好序的键列表上二分查找起点，只遍历匹配的部分；
+3. contains：包含输入，所有键用换行符拼接为一个字符串，由正则表达式在 C 层扫描，再按偏移量二分找到对应的键；
+4. fuzzy：RapidFuzz 相似度匹配，用于输入有错字或顺序不同的情况。
+节点以 FlatTree 中的下标表示，可以直接交给 MeterTreeModel.index_for_node 定位，不再从显示文本中解析。
+"""
+
+
+class NodeIndex:
+    def __init__(self, flat_tree, node_ids):
+        """
+        :param flat_tree: FlatTree
+        :param node_ids: 每个节点的数据点编码（tagCode），没有数据点的节点为空字符串
+        """
+        self.tree = flat_tree
+        # 每个节点的名称和 tagCode 各作为一个键（统一为小写），keys[i] 对应节点 key_nodes[i]
+        self.keys = []
+        self.key_nodes = []
+        for node, (name, node_id) in enumerate(zip(flat_tree.names, node_ids)):
+            for key in (str(name), str(node_id) if node_id else ''):
+                if key.strip():
+                    self.keys.append(key.strip().lower())
+                    self.key_nodes.append(node)
+
+        self.exact_index = {}
+        for key, node in zip(self.keys, self.key_nodes):
+            self.exact_index.setdefault(key, []).append(node)
+        self.sorted_keys = sorted(zip(self.keys, self.key_nodes))
+        self.sorted_prefixes = [key for key, _ in self.sorted_keys]
+        # 拼接后每个键的起始偏移量（键中的换行符替换为空格，保证不跨键匹配）
+        self.text = '\n'.join(key.replace('\n', ' ') for key in self.keys)
+        self.offsets = [0]
+        for key in self.keys[:-1]:
+            self.offsets.append(self.offsets[-1] + len(key) + 1)
+
+    def __len__(self):
+        return len(self.tree)
+
+    @staticmethod
+    def _unique(nodes, limit=None):
+        """按出现顺序去重"""
+        result = list(dict.fromkeys(nodes))
+        return result if limit is None else result[:limit]
+
+    def exact(self, query):
+        """名称或 tagCode 完全相同的节点"""
+        return list(self.exact_index.get(query.strip().lower(), []))
+
+    def prefix(self, query, limit=None):
+        """名称或 tagCode 以 query 开头的节点，按键排序"""
+        query = query.strip().lower()
+        nodes = []
+        position = bisect.bisect_left(self.sorted_prefixes, query)
+        while position < len(self.sorted_keys) and self.sorted_prefixes[position].startswith(query):
+            nodes.append(self.sorted_keys[position][1])
+            if limit is not None and len(nodes) >= limit:
+                break
+            position += 1
+        return self._unique(nodes, limit)
+
+    def contains(self, query, limit=None):
+        """名称或 tagCode 包含 query 的节点，按节点顺序"""
+        query = query.strip().lower()
+        if not query or '\n' in query:
+            return []
+        # 键按节点顺序排列，匹配结果自然按节点顺序，达到 limit 后即可停止扫描
+        nodes = {}
+        for match in re.finditer(re.escape(query), self.text):
+            nodes[self.key_nodes[bisect.bisect_right(self.offsets, match.start()) - 1]] = None
+            if limit is not None and len(nodes) >= limit:
+                break
+        return list(nodes)
+
+    def fuzzy(self, query, limit=10, score_cutoff=60):
+        """
+        相似度最高的节点。
+        :return: [(节点下标, 相似度 0 ~ 100), ...]，按相似度从高到低排序
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        result = {}
+        # 键已统一为小写，不再逐个预处理；fuzz.ratio 比 WRatio 快一个数量级，作为兜底的模糊匹配足够
+        for _, score, position in process.extract(query, self.keys, scorer=fuzz.ratio, processor=None,
+                                                  limit=limit * 2, score_cutoff=score_cutoff):
+            node = self.key_nodes[position]
+            result[node] = max(score, result.get(node, 0))
+        return sorted(result.items(), key=lambda item: -item[1])[:limit]
+
+    def search(self, query, limit=None):
+        """
+        依次按完全匹配、前缀匹配、包含匹配查找，都没有结果时使用相似度匹配。
+        :return: 节点下标列表，越靠前越匹配
+        """
+        query = query.strip()
+        if not query:
+            return []
+        nodes = self._unique(self.exact(query) + self.prefix(query) + self.contains(query), limit)
+        if not nodes:
+            nodes = [node for node, _ in self.fuzzy(query, limit=limit or 10)]
+        return nodes
+
+    def path(self, node):
+        """节点在树中的路径（从根节点到节点自身的名称列表）"""
+        return [self.tree.names[index] for index in reversed([node] + self.tree.ancestors(node))]
+
+    def path_text(self, node, separator=' / '):
+        """节点路径的文本形式，如 电池车间耗电 / 澳电1 / 111AH1"""
+        return separator.join(str(name) for name in self.path(node))
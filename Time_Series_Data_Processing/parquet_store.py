@@ -0,0 +1,137 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+"""
+parquet_store.py
+
+按日期和站点前缀分区的 Parquet 列式存储，替代单个 combined_cut_df.pkl：
+    store_dir/
+        site=SJ-A/
+            date=2025-03-28/
+                part-0.parquet     该站点当天的所有数据点（time、tagCode、tagValue、diff 等列），zstd 压缩
+        site=SJ-T/
+            ...
+
+站点前缀取 tagCode 的前两段（如 SJ-T-99-9-Edc-0103_AE01_F 的站点前缀为 SJ-T）。
+写入时与分区中已有的数据合并，tagCode 和 time 都相同的点以新数据为准，重复运行不会产生重复数据。
+读取时只读取需要的列，并按时间范围、tagCode、站点过滤，不相关的分区和行组不会被读取。
+store_dates 只列出分区目录即可得到已有数据的日期；read_last_readings 取每个 tagCode 在某个时间之前的最后一个读数，增量运行时用于衔接上一次运行的用量计算。
+Parquet 文件与 pandas 版本无关，可以在不同环境之间直接共享。
+"""
+
+PARTITIONING = ds.partitioning(pa.schema([('site', pa.string()), ('date', pa.string())]), flavor='hive')
+PARTITION_COLUMNS = ['site', 'date']
+
+
+def site_of(tagCode):
+    """取 tagCode 的站点前缀，如 SJ-T-99-9-Edc-0103_AE01_F -> SJ-T"""
+    return '-'.join(tagCode.split('-', 2)[:2])
+
+
+def _partition_dir(store_dir, site, date):
+    return os.path.join(store_dir, f"site={site}", f"date={date}")
+
+
+def write_store(df, store_dir, compression='zstd'):
+    """
+    将数据写入分区存储，已存在的分区与新数据合并后整体重写。
+    :param df: 至少包含 time（datetime）和 tagCode 两列的 DataFrame
+    :param store_dir: 存储根目录，不存在时自动创建
+    :param compression: Parquet 压缩算法
+    :return: 写入的分区数量
+    """
+    if df.empty:
+        return 0
+    df = df.copy()
+    # 分类列转换为字符串写入，避免分区之间的类别不一致
+    df['tagCode'] = df['tagCode'].astype(str)
+    sites = df['tagCode'].map(site_of)
+    dates = df['time'].dt.strftime('%Y-%m-%d')
+
+    count = 0
+    for (site, date), part in df.groupby([sites, dates], sort=True):
+        part_dir = _partition_dir(store_dir, site, date)
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, 'part-0.parquet')
+        if os.path.exists(path):
+            part = pd.concat([pd.read_parquet(path), part], ignore_index=True)
+        part = (part.drop_duplicates(subset=['tagCode', 'time'], keep='last')
+                .sort_values(by=['tagCode', 'time'])
+                .reset_index(drop=True))
+        # 先写临时文件再替换，中途中断不会留下损坏的分区
+        tmp_path = path + '.tmp'
+        pq.write_table(pa.Table.from_pandas(part, preserve_index=False), tmp_path, compression=compression)
+        os.replace(tmp_path, path)
+        count += 1
+    return count
+
+
+def read_store(store_dir, columns=None, start_time=None, end_time=None, tagCodes=None, sites=None):
+    """
+    从分区存储中读取数据。
+    :param store_dir: 存储根目录
+    :param columns: 需要读取的列，None 表示读取全部数据列（不含 site、date 分区列）
+    :param start_time: 起始时间（包含），None 表示不限制
+    :param end_time: 截止时间（包含），None 表示不限制
+    :param tagCodes: 只读取这些 tagCode，None 表示全部
+    :param sites: 只读取这些站点前缀（如 ['SJ-A', 'SJ-T']），None 表示全部；指定 tagCodes 时自动推断
+    :return: DataFrame
+    """
+    if not os.path.isdir(store_dir):
+        raise FileNotFoundError(f"Parquet 存储不存在: {store_dir}")
+    dataset = ds.dataset(store_dir, format='parquet', partitioning=PARTITIONING)
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name not in PARTITION_COLUMNS]
+
+    # 分区列上的条件用于跳过整个目录，数据列上的条件用于跳过行组和过滤行
+    conditions = []
+    if start_time is not None:
+        start = pd.Timestamp(start_time)
+        conditions += [ds.field('date') >= start.strftime('%Y-%m-%d'), ds.field('time') >= start]
+    if end_time is not None:
+        end = pd.Timestamp(end_time)
+        conditions += [ds.field('date') <= end.strftime('%Y-%m-%d'), ds.field('time') <= end]
+    if tagCodes is not None:
+        tagCodes = list(tagCodes)
+        if sites is None:
+            sites = sorted({site_of(tagCode) for tagCode in tagCodes})
+        conditions.append(ds.field('tagCode').isin(tagCodes))
+    if sites is not None:
+        conditions.append(ds.field('site').isin(list(sites)))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def store_dates(store_dir):
+    """列出存储中已有数据的日期（按分区目录名，不读取任何文件），升序排列"""
+    dates = set()
+    if os.path.isdir(store_dir):
+        for site_dir in os.listdir(store_dir):
+            site_path = os.path.join(store_dir, site_dir)
+            if site_dir.startswith('site=') and os.path.isdir(site_path):
+                dates.update(name[len('date='):] for name in os.listdir(site_path) if name.startswith('date='))
+    return sorted(dates)
+
+
+def read_last_readings(store_dir, before, lookback='1d'):
+    """
+    读取每个 tagCode 在指定时间之前（不含）最后一个有读数的数据点，用于与上一次运行的结果衔接计算用量。
+    :param store_dir: 存储根目录，不存在时返回空表
+    :param before: {tagCode: 时间}，如本次结果中每个 tagCode 的第一个时间桶
+    :param lookback: 向前查找的最大时长，更早的读数不再衔接
+    :return: 包含 time、tagCode、tagValue 列的 DataFrame，每个 tagCode 最多一行
+    """
+    columns = ['time', 'tagCode', 'tagValue']
+    if not before or not os.path.isdir(store_dir):
+        return pd.DataFrame(columns=columns)
+    before = pd.Series(before, dtype='datetime64[ns]')
+    df = read_store(store_dir, columns=columns, start_time=before.min() - pd.Timedelta(lookback),
+                    end_time=before.max(), tagCodes=before.index)
+    df = df[df['tagValue'].notna() & (df['time'] < df['tagCode'].map(before))]
+    return df.sort_values(by=['tagCode', 'time']).groupby('tagCode').tail(1).reset_index(drop=True)
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+"""
+resample_engine.py
+
+按固定粒度对所有 tag 一次性重采样，替代 groupby('tagCode').resample(...).first()：
+1. 以数据中最早一天的 0 点为原点，用整数运算计算每个数据点所在的时间桶编号（bucket = (time - 原点) // 粒度）；
+2. 按 (tagCode, 时间桶, time) 做一次稳定排序，每个 (tagCode, 时间桶) 取第一个数据点，不需要逐个分组重采样；
+3. tagValue 为空的数据点先被丢弃（与 resample().first() 取第一个非空值一致）；
+   没有数据的时间桶不会生成全为 NaN 的行，缺口由下游的 consumption_delta 按时间间隔处理。
+同时返回长格式结果和 tag × 时间桶 的稠密矩阵，矩阵中没有数据的位置为 NaN。
+"""
+
+DAY_NS = pd.Timedelta(days=1).value
+
+
+def resample_first(df, granularity_minutes, dense=True):
+    """
+    每个 tagCode 在每个时间桶内取第一个数据点。
+    :param df: 包含 time（datetime）、tagCode、tagValue 列的 DataFrame
+    :param granularity_minutes: 重采样粒度（分钟）
+    :param dense: 是否同时构建稠密矩阵
+    :return: (长格式 DataFrame, 稠密矩阵)。长格式包含 time（时间桶起点）、tagValue、tagCode（categorical）三列，
+             按 tagCode 和 time 排序；稠密矩阵为 (时间轴 DatetimeIndex, tagCode 列表, 二维数组)，dense=False 时为 None
+    """
+    step_ns = pd.Timedelta(minutes=granularity_minutes).value
+    df = df.dropna(subset=['time', 'tagValue'])
+    tag_codes, tags = pd.factorize(df['tagCode'], sort=True)
+    tags = [str(tag) for tag in tags]
+    times = df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    values = df['tagValue'].to_numpy(dtype=np.float64)
+
+    if len(times) == 0:
+        long_df = pd.DataFrame({
+            'time': pd.Series(dtype='datetime64[ns]'),
+            'tagValue': pd.Series(dtype=np.float64),
+            'tagCode': pd.Categorical([], categories=tags),
+        })
+        return long_df, ((pd.DatetimeIndex([], name='time'), tags, np.empty((len(tags), 0))) if dense else None)
+
+    origin = times.min() // DAY_NS * DAY_NS
+    buckets = (times - origin) // step_ns
+
+    # 按 (tagCode, 时间桶) 组合键稳定排序，再在每组内取 time 最小的数据点（time 相同时取原有顺序中的第一个），
+    # 不需要按 time 做第二次排序
+    keys = tag_codes.astype(np.int64) * (buckets.max() + 1) + buckets
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    sorted_times = times[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    group_ids = np.repeat(np.arange(len(group_starts)), np.diff(np.r_[group_starts, len(order)]))
+    candidates = np.flatnonzero(sorted_times == np.minimum.reduceat(sorted_times, group_starts)[group_ids])
+    candidate_groups = group_ids[candidates]
+    picked = order[candidates[np.r_[True, candidate_groups[1:] != candidate_groups[:-1]]]]
+
+    result_codes = tag_codes[picked]
+    result_buckets = buckets[picked]
+    result_values = values[picked]
+    long_df = pd.DataFrame({
+        'time': (origin + result_buckets * step_ns).view('datetime64[ns]'),
+        'tagValue': result_values,
+        'tagCode': pd.Categorical.from_codes(result_codes, categories=tags),
+    })
+    if not dense:
+        return long_df, None
+
+    first_bucket = result_buckets.min()
+    bucket_count = int(result_buckets.max() - first_bucket + 1)
+    axis = pd.date_range(pd.Timestamp(int(origin + first_bucket * step_ns)), periods=bucket_count,
+                         freq=f'{granularity_minutes}min', name='time')
+    matrix = np.full((len(tags), bucket_count), np.nan)
+    matrix[result_codes, result_buckets - first_bucket] = result_values
+    return long_df, (axis, tags, matrix)
@@ -0,0 +1,268 @@
+import os
+import numpy as np
+import pandas as pd
+
+"""
+rollup_cube.py
+
+多粒度用量汇总（5 分钟、15 分钟、1 小时、1 天、1 个月），替代每次按单一 granularity_minutes 重新跑一遍流程，
+以及 temporary_storages/01.时间戳标准化.py 中按 strftime('%Y-%m-%d %H:00:00') 字符串分组的小时汇总：
+1. 由长格式结果（time、tagCode、diff）一次性构建基础粒度的 tag × 时间桶 矩阵，时间轴从第一天 0 点开始、到最后一天结束；
+2. 每一级由上一级（更细的粒度）求和得到：相邻粒度为整数倍时通过 reshape 后按轴求和，月份由天按月份边界 reduceat 求和，
+   不再从原始数据重新计算；
+3. 同时汇总每个时间桶内的有效数据点个数，没有任何数据的时间桶结果为 NaN（而不是 0）；
+4. 汇总结果可以保存为 .npz 文件，报表在任意粒度上都只是查表；
+5. 长期保存使用 RollupStore 按天分块：增量运行只重写本次涉及的天（受影响的 tag 以新结果为准）和这些天所在月份的月汇总，
+   写入量与本次的时间范围有关，而与历史长度无关；读取时按时间范围只加载需要的分块。
+"""
+
+# 汇总粒度：名称 -> 分钟数（月份不是固定分钟数，单独处理）
+LEVELS = {'5min': 5, '15min': 15, '1h': 60, '1d': 1440, '1M': None}
+# 按天分块保存的粒度（每天的时间桶个数固定）
+DAY_LEVELS = [name for name, minutes in LEVELS.items() if minutes is not None]
+
+
+class RollupCube:
+    def __init__(self, tagCodes, levels):
+        """
+        :param tagCodes: tagCode 列表，对应矩阵的行
+        :param levels: {粒度名称: (时间轴 DatetimeIndex, 用量矩阵)}
+        """
+        self.tagCodes = list(tagCodes)
+        self.levels = levels
+        self.rows = {tagCode: row for row, tagCode in enumerate(self.tagCodes)}
+
+    @classmethod
+    def from_frame(cls, df, base_minutes, value_column='diff', levels=tuple(LEVELS)):
+        """
+        由长格式结果构建各粒度的汇总。
+        :param df: 包含 time（已对齐到 base_minutes 的时间桶起点）、tagCode 和 value_column 列的 DataFrame
+        :param base_minutes: 基础粒度（分钟），需能整除 1 天
+        :param value_column: 汇总的数值列
+        :param levels: 需要的汇总粒度，比基础粒度更细或不是其整数倍的粒度会被跳过
+        """
+        if 1440 % base_minutes:
+            raise ValueError(f"基础粒度 {base_minutes} 分钟不能整除 1 天")
+        base_ns = pd.Timedelta(minutes=base_minutes).value
+        tag_codes, tags = pd.factorize(df['tagCode'], sort=True)
+        tags = [str(tag) for tag in tags]
+        times = df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        values = df[value_column].to_numpy(dtype=np.float64)
+        if len(times) == 0:
+            return cls(tags, {})
+
+        # 基础矩阵：时间轴补齐到整天，便于逐级 reshape
+        day_ns = pd.Timedelta(days=1).value
+        origin = times.min() // day_ns * day_ns
+        day_count = int((times.max() - origin) // day_ns + 1)
+        per_day = 1440 // base_minutes
+        buckets = (times - origin) // base_ns
+        valid = ~np.isnan(values)
+        sums = np.zeros((len(tags), day_count * per_day))
+        counts = np.zeros((len(tags), day_count * per_day), dtype=np.int64)
+        np.add.at(sums, (tag_codes[valid], buckets[valid]), values[valid])
+        np.add.at(counts, (tag_codes[valid], buckets[valid]), 1)
+
+        result = {}
+        minutes = base_minutes
+        start = pd.Timestamp(int(origin))
+        for name in LEVELS:
+            level_minutes = LEVELS[name]
+            if level_minutes is None:
+                # 月份：按每天所在的月份求和
+                days = pd.date_range(start, periods=sums.shape[1], freq='D')
+                month_starts = np.flatnonzero(np.r_[True, days.month[1:] != days.month[:-1]])
+                sums = np.add.reduceat(sums, month_starts, axis=1)
+                counts = np.add.reduceat(counts, month_starts, axis=1)
+                # 以每月 1 日为时间桶起点（第一个月的数据可能不是从 1 日开始）
+                axis = pd.DatetimeIndex(days[month_starts].to_period('M').to_timestamp(), name='time')
+            elif level_minutes < minutes or level_minutes % minutes:
+                continue
+            else:
+                factor = level_minutes // minutes
+                sums = sums.reshape(len(tags), -1, factor).sum(axis=2)
+                counts = counts.reshape(len(tags), -1, factor).sum(axis=2)
+                minutes = level_minutes
+                axis = pd.date_range(start, periods=sums.shape[1], freq=f'{level_minutes}min', name='time')
+            if name in levels:
+                result[name] = (axis, np.where(counts > 0, sums, np.nan))
+        return cls(tags, result)
+
+    def level(self, name):
+        """返回某个粒度的 (时间轴, tagCode 列表, 用量矩阵)"""
+        if name not in self.levels:
+            raise KeyError(f"没有 {name} 粒度的汇总，可用的粒度: {list(self.levels)}")
+        axis, matrix = self.levels[name]
+        return axis, self.tagCodes, matrix
+
+    def to_frame(self, name, tagCodes=None, start_time=None, end_time=None):
+        """
+        以长格式返回某个粒度的汇总结果。
+        :param tagCodes: 只返回这些 tagCode（如 TagCodeRegistry.select 的结果），不在汇总中的 tagCode 忽略；None 表示全部
+        :return: 包含 time、tagCode、diff 列的 DataFrame，只包含有数据的时间桶
+        """
+        axis, _, matrix = self.level(name)
+        if tagCodes is None:
+            rows = np.arange(len(self.tagCodes))
+        else:
+            rows = np.array([self.rows[t] for t in tagCodes if t in self.rows], dtype=int)
+        columns = np.ones(len(axis), dtype=bool)
+        if start_time is not None:
+            columns &= axis >= pd.Timestamp(start_time)
+        if end_time is not None:
+            columns &= axis <= pd.Timestamp(end_time)
+        block = matrix[np.ix_(rows, np.flatnonzero(columns))]
+        row_index, column_index = np.nonzero(~np.isnan(block))
+        return pd.DataFrame({
+            'time': axis[columns][column_index],
+            'tagCode': pd.Categorical.from_codes(rows[row_index], categories=self.tagCodes),
+            'diff': block[row_index, column_index],
+        })
+
+    def save(self, path):
+        """保存为 .npz 文件"""
+        arrays = {'tagCodes': np.array(self.tagCodes, dtype=str)}
+        for name, (axis, matrix) in self.levels.items():
+            arrays[f'{name}_time'] = axis.to_numpy(dtype='datetime64[ns]')
+            arrays[f'{name}_values'] = matrix
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """读取 save 保存的 .npz 文件"""
+        with np.load(path) as data:
+            levels = {
+                name: (pd.DatetimeIndex(data[f'{name}_time'], name='time'), data[f'{name}_values'])
+                for name in LEVELS if f'{name}_values' in data
+            }
+            return cls(data['tagCodes'].tolist(), levels)
+
+
+class RollupStore:
+    def __init__(self, store_dir):
+        """
+        按天分块保存的多粒度汇总，目录结构如下：
+            store_dir/
+                days/2025-03-28.npz    当天各粒度（5min ~ 1d）的 tag × 时间桶 矩阵及其 tagCodes
+                months/2025-03.npz     当月的 1M 汇总，由该月各天的 1d 汇总求和得到
+        :param store_dir: 存储目录，不存在时自动创建
+        """
+        self.store_dir = store_dir
+        os.makedirs(os.path.join(store_dir, 'days'), exist_ok=True)
+        os.makedirs(os.path.join(store_dir, 'months'), exist_ok=True)
+
+    def _day_path(self, day):
+        return os.path.join(self.store_dir, 'days', f"{day.strftime('%Y-%m-%d')}.npz")
+
+    def _month_path(self, month):
+        return os.path.join(self.store_dir, 'months', f"{month.strftime('%Y-%m')}.npz")
+
+    @staticmethod
+    def _read_chunk(path):
+        """读取一个分块，返回 (tagCode 列表, {粒度名称: 矩阵})，分块不存在时返回 ([], {})"""
+        if not os.path.exists(path):
+            return [], {}
+        with np.load(path) as data:
+            return data['tagCodes'].tolist(), {name: data[name] for name in LEVELS if name in data}
+
+    @staticmethod
+    def _write_chunk(path, tagCodes, matrices):
+        """先写临时文件再替换，避免写入中途中断导致分块损坏"""
+        with open(path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, tagCodes=np.array(tagCodes, dtype=str), **matrices)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _combine(old_tags, old, new_tags, new):
+        """合并同一分块的新旧结果：new 中的 tagCode 以 new 为准，其余 tagCode 保留 old 中的结果"""
+        tags = sorted(set(old_tags) | set(new_tags))
+        rows = {tag: row for row, tag in enumerate(tags)}
+        matrices = {}
+        for name, matrix in new.items():
+            combined = np.full((len(tags), matrix.shape[1]), np.nan)
+            if name in old:
+                combined[[rows[tag] for tag in old_tags]] = old[name]
+            combined[[rows[tag] for tag in new_tags]] = matrix
+            matrices[name] = combined
+        return tags, matrices
+
+    def write(self, cube):
+        """
+        将 RollupCube（如由存储中受本次运行影响的整天数据构建的汇总）写入对应的天，再重新汇总这些天所在的月份。
+        cube 中的每个 tagCode 在 cube 覆盖的天以 cube 为准，其余 tagCode 和其他天的分块保持不变。
+        :return: 写入的天数
+        """
+        day_levels = [name for name in DAY_LEVELS if name in cube.levels]
+        if not day_levels:
+            return 0
+        days = cube.levels[day_levels[0]][0].normalize().unique()
+        for day in days:
+            new = {}
+            for name in day_levels:
+                axis, matrix = cube.levels[name]
+                first = (day - axis[0]) // pd.Timedelta(minutes=LEVELS[name])
+                new[name] = matrix[:, first:first + 1440 // LEVELS[name]]
+            old_tags, old = self._read_chunk(self._day_path(day))
+            self._write_chunk(self._day_path(day), *self._combine(old_tags, old, cube.tagCodes, new))
+
+        if '1M' in cube.levels and '1d' in day_levels:
+            for month in days.to_period('M').unique().to_timestamp():
+                self._write_month(month)
+        return len(days)
+
+    def _write_month(self, month):
+        """由该月各天分块的 1d 汇总重新计算月汇总，没有任何数据的 tag 为 NaN"""
+        chunks = [self._read_chunk(self._day_path(day))
+                  for day in pd.date_range(month, month + pd.offsets.MonthEnd(0), freq='D')]
+        chunks = [(tags, matrices['1d'][:, 0]) for tags, matrices in chunks if '1d' in matrices]
+        tags = sorted(set().union(*[tags for tags, _ in chunks]))
+        rows = {tag: row for row, tag in enumerate(tags)}
+        sums = np.zeros(len(tags))
+        counts = np.zeros(len(tags), dtype=np.int64)
+        for chunk_tags, values in chunks:
+            chunk_rows = [rows[tag] for tag in chunk_tags]
+            valid = ~np.isnan(values)
+            np.add.at(sums, np.array(chunk_rows, dtype=int)[valid], values[valid])
+            np.add.at(counts, np.array(chunk_rows, dtype=int)[valid], 1)
+        self._write_chunk(self._month_path(month), tags, {'1M': np.where(counts > 0, sums, np.nan)[:, None]})
+
+    def load(self, start_time=None, end_time=None, levels=tuple(LEVELS)):
+        """
+        读取 [start_time, end_time] 所在的天（月汇总为所在的月份）的分块，组装为 RollupCube。
+        时间轴从第一个分块到最后一个分块连续，中间缺少的天为 NaN。
+        :param levels: 需要的汇总粒度
+        """
+        start = pd.Timestamp(start_time) if start_time is not None else None
+        end = pd.Timestamp(end_time) if end_time is not None else None
+        chunks = {}
+        for folder, period in (('days', 'D'), ('months', 'M')):
+            names = sorted(name[:-len('.npz')] for name in os.listdir(os.path.join(self.store_dir, folder))
+                           if name.endswith('.npz'))
+            periods = [pd.Period(name, freq=period) for name in names]
+            chunks[folder] = [
+                (p.to_timestamp(), self._read_chunk(os.path.join(self.store_dir, folder, f'{name}.npz')))
+                for name, p in zip(names, periods)
+                if (start is None or p.end_time >= start) and (end is None or p.start_time <= end)
+            ]
+
+        tags = sorted(set().union(*[chunk_tags for folder in chunks.values() for _, (chunk_tags, _) in folder]))
+        rows = {tag: row for row, tag in enumerate(tags)}
+        result = {}
+        for name in levels:
+            folder = 'months' if LEVELS[name] is None else 'days'
+            level_chunks = [(time, chunk_tags, matrices[name])
+                            for time, (chunk_tags, matrices) in chunks[folder] if name in matrices]
+            if not level_chunks:
+                continue
+            if LEVELS[name] is None:
+                axis = pd.date_range(level_chunks[0][0], level_chunks[-1][0], freq='MS', name='time')
+            else:
+                step = pd.Timedelta(minutes=LEVELS[name])
+                axis = pd.date_range(level_chunks[0][0], level_chunks[-1][0] + pd.Timedelta(days=1) - step,
+                                     freq=step, name='time')
+            matrix = np.full((len(tags), len(axis)), np.nan)
+            for time, chunk_tags, values in level_chunks:
+                first = axis.get_loc(time)
+                matrix[[rows[tag] for tag in chunk_tags], first:first + values.shape[1]] = values
+            result[name] = (axis, matrix)
+        return RollupCube(tags, result)
@@ -604,20 +604,22 @@ def generate_tagcodes(input_data=input_data):
 
     return input_codes
 
-# 生成标签代码字典
-tagCodes = generate_tagcodes()
+# 直接运行时才写出文件，被其他脚本导入时只提供 generate_tagcodes
+if __name__ == '__main__':
+    # 生成标签代码字典
+    tagCodes = generate_tagcodes()
 
-# 获取当前时间戳，并生成文件名
-timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-filename = f'tagCodes_{timestamp}.txt'
+    # 获取当前时间戳，并生成文件名
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f'tagCodes_{timestamp}.txt'
 
-# print (generate_tagcodes())
+    # print (generate_tagcodes())
 
-# 写入带时间戳的文件
-with open(filename, 'w') as file:
-    file.write("tagCodes = [\n")
-    for code in tagCodes:
-        file.write(f'    "{code}",\n')
-    file.write("]\n")
+    # 写入带时间戳的文件
+    with open(filename, 'w') as file:
+        file.write("tagCodes = [\n")
+        for code in tagCodes:
+            file.write(f'    "{code}",\n')
+        file.write("]\n")
 
-print(f"内容已写入 {filename} 文件。")
+    print(f"内容已写入 {filename} 文件。")
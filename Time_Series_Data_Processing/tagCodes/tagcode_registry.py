@@ -0,0 +1,141 @@
+import re
+import pandas as pd
+from tagCodes.tagcode_generator import generate_tagcodes
+
+"""
+tagcode_registry.py
+
+标签代码登记表：将每个标签代码一次性解析为各个字段，并为每个字段的每个取值预先建立位图索引。
+标签代码格式（以 'SJ-B-24-9-Edc-0050_AE01_F' 为例）：
+    base      SJ     基地
+    area      B      厂区
+    building  24     建筑编号
+    category  9      分类
+    device    Edc    设备类型（Edc / Hvm / Efp ...）
+    serial    0050   设备序号
+    measure   AE01   测点
+    suffix    F      后缀
+另有 site 字段（如 'SJ-B'），与 parquet_store.site_of 的站点前缀一致。
+
+位图以 Python 整数表示，第 i 位对应第 i 个标签代码。select 对同一字段的多个取值做或运算、对不同字段做与运算，
+筛选只是几次整数位运算，与标签代码总数无关，结果可以直接作为 BatchFetcher 或 RollupCube.to_frame 的 tagCodes 参数。
+
+使用示例：
+    registry = TagCodeRegistry.from_generator()
+    tagCodes = registry.select(site='SJ-A', device='Hvm', building='20')
+"""
+
+TAGCODE_PATTERN = re.compile(r'^([A-Z]+)-([A-Z])-(\d+)-(\d+)-([A-Za-z]+)-(\d+)_([A-Z0-9]+)_([A-Z0-9]+)$')
+# 正则表达式各分组对应的字段
+FIELDS = ['base', 'area', 'building', 'category', 'device', 'serial', 'measure', 'suffix']
+# 建立位图索引的字段（serial 几乎每个标签代码都不同，不建立索引）
+INDEXED_FIELDS = ['site', 'base', 'area', 'building', 'category', 'device', 'measure', 'suffix']
+
+
+def positions_to_bits(positions, size):
+    """将位置列表转换为位图（整数），一次性构建，避免逐位或运算反复创建大整数"""
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def parse_tagcode(tagCode):
+    """
+    解析单个标签代码。
+    :return: {字段: 取值} 字典，格式不符时返回 None
+    """
+    match = TAGCODE_PATTERN.match(tagCode)
+    if match is None:
+        return None
+    fields = dict(zip(FIELDS, match.groups()))
+    fields['site'] = f"{fields['base']}-{fields['area']}"
+    return fields
+
+
+class TagCodeRegistry:
+    def __init__(self, tagCodes):
+        """
+        :param tagCodes: 标签代码列表，重复的只保留第一个，格式不符的记录在 unparsed 中
+        """
+        self.tagCodes = []
+        self.unparsed = []
+        rows = []
+        for tagCode in dict.fromkeys(tagCodes):
+            fields = parse_tagcode(tagCode)
+            if fields is None:
+                self.unparsed.append(tagCode)
+                continue
+            self.tagCodes.append(tagCode)
+            rows.append(fields)
+        self.positions = {tagCode: position for position, tagCode in enumerate(self.tagCodes)}
+
+        # 每个字段、每个取值的位图
+        positions = {field: {} for field in INDEXED_FIELDS}
+        for position, fields in enumerate(rows):
+            for field in INDEXED_FIELDS:
+                positions[field].setdefault(fields[field], []).append(position)
+        self.bitmaps = {
+            field: {value: positions_to_bits(value_positions, len(rows)) for value, value_positions in values.items()}
+            for field, values in positions.items()
+        }
+        self.all_bits = (1 << len(self.tagCodes)) - 1
+
+        # 解析后的字段表：建立索引的字段为 category 类型，序号另存为整数
+        self.frame = pd.DataFrame(rows, columns=['site'] + FIELDS, index=pd.Index(self.tagCodes, name='tagCode'))
+        self.frame['serial_number'] = self.frame['serial'].astype(int)
+        for field in INDEXED_FIELDS:
+            self.frame[field] = self.frame[field].astype('category')
+
+    @classmethod
+    def from_generator(cls):
+        """由 tagcode_generator.generate_tagcodes 生成的标签代码构建"""
+        return cls(generate_tagcodes())
+
+    def __len__(self):
+        return len(self.tagCodes)
+
+    def __contains__(self, tagCode):
+        return tagCode in self.positions
+
+    def values(self, field):
+        """某个字段的所有取值"""
+        return sorted(self.bitmaps[field])
+
+    def mask(self, **criteria):
+        """
+        按字段筛选，返回位图。
+        :param criteria: 字段=取值，取值可以是单个值或多个值的列表（多个值之间为"或"），如 site='SJ-A', device=['Hvm', 'Edc']；
+                         取值与标签代码中的写法一致，如 building='02'
+        """
+        result = self.all_bits
+        for field, values in criteria.items():
+            if field not in self.bitmaps:
+                raise KeyError(f"不支持按 {field} 筛选，可用的字段: {INDEXED_FIELDS}")
+            bitmap = self.bitmaps[field]
+            if isinstance(values, (str, int)):
+                values = [values]
+            field_bits = 0
+            for value in values:
+                field_bits |= bitmap.get(str(value), 0)
+            result &= field_bits
+        return result
+
+    def from_mask(self, bits):
+        """将位图转换为标签代码列表（按登记顺序）"""
+        # 二进制字符串反转后第 i 个字符即第 i 位
+        digits = bin(bits)[:1:-1]
+        return [self.tagCodes[position] for position, digit in enumerate(digits) if digit == '1']
+
+    def to_mask(self, tagCodes):
+        """将标签代码列表转换为位图，未登记的标签代码忽略"""
+        positions = [self.positions[tagCode] for tagCode in tagCodes if tagCode in self.positions]
+        return positions_to_bits(positions, len(self.tagCodes))
+
+    def select(self, **criteria):
+        """按字段筛选，返回标签代码列表，参数同 mask"""
+        return self.from_mask(self.mask(**criteria))
+
+    def count(self, **criteria):
+        """按字段筛选，返回匹配的标签代码数量"""
+        return bin(self.mask(**criteria)).count('1')
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+"""
+tag_value_decoder.py
+
+按列向量化解码接口返回的 tagValue，替代逐行调用的 convert_tag_value。
+解码规则与原 convert_tag_value 一致：
+1. 数值及数值字符串转换为浮点数；
+2. 布尔值以及 "true"/"false" 字符串（不区分大小写）转换为 1.0 / 0.0；
+3. 其余无法解码的值记为 NaN，并在汇总信息中给出数量和示例，而不是打印整列数据。
+"""
+
+# 布尔字符串到数值的映射
+BOOL_STRINGS = {'true': 1.0, 'false': 0.0}
+
+
+def decode_tag_values(values, sample_size=5):
+    """
+    向量化解码 tagValue 列。
+    :param values: 原始 tagValue 序列（Series 或列表）
+    :param sample_size: 汇总信息中保留的无法解码示例个数
+    :return: (float64 的 Series, 汇总信息字典)
+    """
+    values = pd.Series(values)
+    decoded = pd.to_numeric(values, errors='coerce').astype(np.float64)
+
+    # 数值转换失败的非空值，再按布尔字符串解码
+    remaining = decoded.isna() & values.notna()
+    if remaining.any():
+        decoded[remaining] = values[remaining].astype(str).str.strip().str.lower().map(BOOL_STRINGS)
+
+    missing = values.isna()
+    undecodable = decoded.isna() & ~missing
+    summary = {
+        'total': len(values),
+        'missing': int(missing.sum()),
+        'undecodable': int(undecodable.sum()),
+        'samples': values[undecodable].drop_duplicates().head(sample_size).tolist(),
+    }
+    return decoded, summary
+
+
+def format_decode_summary(summary):
+    """将解码汇总信息格式化为一行文字"""
+    return (f"tagValue 解码: 共 {summary['total']} 个值，空值 {summary['missing']} 个，"
+            f"无法解码 {summary['undecodable']} 个，示例: {summary['samples']}")
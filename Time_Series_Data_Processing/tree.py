@@ -1,49 +1,78 @@
 import sys
-import pandas as pd
 from PyQt5.QtWidgets import (
-    QApplication, QTreeWidget, QTreeWidgetItem, QVBoxLayout, QHBoxLayout, QWidget, QPushButton,
-    QMenu, QAction, QLabel
+    QApplication, QTreeView, QAbstractItemView, QVBoxLayout, QHBoxLayout, QWidget, QPushButton,
+    QMenu, QAction, QLabel, QLineEdit
 )
 import pyperclip  # 用于复制到剪贴板
-from PyQt5.QtCore import Qt
-
-# 读取 combined_cut_df.pkl 文件并计算 diff 的聚合值
-def calculate_diff_values(pkl_file_path):
-    df = pd.read_pickle(pkl_file_path)
-    diff_sum = df.groupby('tagCode')['diff'].sum().round(2)  # 保留两位小数
-    diff_sum.index = diff_sum.index.rename("node_id")  # 将索引名称改为 node_id
-    return diff_sum.to_dict()  # 将计算结果转换为字典格式返回
-
-# 读取时间范围
-def calculate_time_range(file_path):
-    df = pd.read_pickle(file_path)
-    start_time = df['time'].min()
-    end_time = df['time'].max()
-    return {'start_time': start_time, 'end_time': end_time}
-
-# 计算出的 diff_values 是一个字典，key 为 node_id，value 为 diff 的聚合值
-diff_values = calculate_diff_values(rf'../Time_Series_Data_Processing/data_outputs/combined_cut_df-全部电表.pkl')
-print("diff_values:", diff_values)
+from PyQt5.QtCore import Qt, QItemSelection, QItemSelectionModel, QTimer
+from tree_aggregation import SubtreeAggregator, SelectionTotal
+from tree_model import MeterTreeModel, NODE_ID_ROLE, NODE_INDEX_ROLE
+from tree_data_context import TreeDataContext
+from node_index import NodeIndex
+
+# get_data_from_api.py 写出的 Parquet 存储目录
+store_dir = rf'../Time_Series_Data_Processing/data_outputs/parquet_store'
+# 电表结构化清单和名称映射
+excel_path = rf'../Time_Series_Data_Processing/data_inputs/电表结构化清单和名称映射.xlsx'
+# 结构化清单解析结果的缓存文件，Excel 内容改变后自动重新解析
+tree_cache_path = rf'../Time_Series_Data_Processing/data_outputs/电表结构化清单和名称映射.cache.pkl'
+# 汇总的时间范围：Parquet 存储中累积了所有运行的历史，只读取这个窗口内的数据；
+# start_time 为 None 时取 end_time（为 None 时为存储中的最后一天）往前共 view_days 天
+start_time = None
+end_time = None
+view_days = 1
+# 搜索框停止输入多少毫秒后再过滤，连续输入时不会每输入一个字符就重建一次模型
+filter_delay = 300
 
 class TreeWidgetDemo(QWidget):
-    def __init__(self, tree_data, node_mapping, diff_values):
+    def __init__(self, context):
         super().__init__()
-        self.tree_data = tree_data
-        self.node_mapping = node_mapping  # 添加节点映射关系
-        self.diff_values = diff_values  # 添加 diff 值字典
+        self.context = context  # 数据上下文：数据只读取一次，diff 合计和时间范围由其缓存
+        self.node_mapping = node_mapping = context.node_mapping  # 节点映射关系
+        self.diff_values = diff_values = context.diff_values  # diff 值字典，key 为 node_id，value 为 diff 的聚合值
+        # 数组表示的树（先序遍历顺序），计算每个节点的子树合计
+        self.flat_tree = context.flat_tree
+        self.node_ids = [node_mapping.get(name, '') for name in self.flat_tree.names]
+        self.subtree_totals = SubtreeAggregator.from_totals(self.flat_tree, node_mapping, diff_values).totals()
+        # 选中节点的合计：选中或取消选中时按差值更新，祖先已选中的节点不重复计入
+        self.selection_total = SelectionTotal(self.flat_tree, self.subtree_totals)
+        # 树模型：节点在展开时才加载，显示内容在绘制时才从数组中读取
+        own_values = [diff_values.get(node_id) if node_id in diff_values else None for node_id in self.node_ids]
+        self.model = MeterTreeModel(self.flat_tree, self.node_ids, own_values, self.subtree_totals)
+        # 节点索引：按名称或数据点编码查找节点（完全匹配、前缀、包含，找不到时模糊匹配）
+        self.node_index = NodeIndex(self.flat_tree, self.node_ids)
         self.show_alias = False  # 默认不显示别名
+        # 用户展开的节点：过滤会重置模型，重置后按节点下标恢复展开状态（过滤时自动展开的祖先不记录）
+        self.expanded_nodes = set()
+        self.all_expanded = False
+        self.updating_view = False
         # 设置窗口默认大小为800x700
         self.resize(800, 700)
         self.initUI()
 
     def initUI(self):
-        # 创建QTreeWidget并启用多选
-        self.tree = QTreeWidget(self)
-        self.tree.setHeaderLabels(['石家庄基地'])  # 修改标题为 "Node Name"
-        self.tree.setSelectionMode(QTreeWidget.MultiSelection)  # 启用多选模式
-        
-        # 添加选中项变化监听
-        self.tree.itemSelectionChanged.connect(self.update_selection_sum)
+        # 创建QTreeView并启用多选
+        self.tree = QTreeView(self)
+        self.tree.setModel(self.model)  # 表头为 "石家庄基地"
+        self.tree.setSelectionMode(QAbstractItemView.MultiSelection)  # 启用多选模式
+        self.tree.setUniformRowHeights(True)
+
+        # 添加选中项变化监听，只处理本次新增和取消的选中项
+        self.tree.selectionModel().selectionChanged.connect(self.on_selection_changed)
+        # 记录展开和收起的节点，过滤后恢复
+        self.tree.expanded.connect(self.on_expanded)
+        self.tree.collapsed.connect(self.on_collapsed)
+
+        # 创建搜索框：按名称或数据点编码过滤（停止输入 filter_delay 毫秒后执行），回车跳转到最匹配的节点
+        self.search_edit = QLineEdit(self)
+        self.search_edit.setPlaceholderText("按名称或数据点编码搜索，回车跳转")
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(filter_delay)
+        self.filter_timer.timeout.connect(lambda: self.apply_filter(self.search_edit.text()))
+        self.search_edit.textChanged.connect(lambda text: self.filter_timer.start())
+        self.search_edit.returnPressed.connect(self.jump_to_match)
+        self.matches = []
         
         # 创建时间显示标签
         self.start_time_label = QLabel("开始时间: ", self)
@@ -56,9 +85,6 @@ class TreeWidgetDemo(QWidget):
         self.sum_label = QLabel("总和: 0.00", self)
         self.sum_label.setStyleSheet("font-weight: bold; color: black;")
 
-        # 递归构建树状结构
-        self.build_tree(self.tree_data, self.tree)
-
         # 创建“全部展开”按钮
         self.expand_all_button = QPushButton("全部展开", self)
         self.expand_all_button.clicked.connect(self.expand_all_nodes)
@@ -97,6 +123,7 @@ class TreeWidgetDemo(QWidget):
 
         # 将各个布局添加到主布局
         layout.addLayout(top_layout)
+        layout.addWidget(self.search_edit)
         layout.addWidget(self.tree)
         layout.addLayout(button_layout)
         self.setLayout(layout)
@@ -110,98 +137,104 @@ class TreeWidgetDemo(QWidget):
 
     def update_time_labels(self):
         """更新时间显示标签"""
-        time_range = calculate_time_range(rf'../Time_Series_Data_Processing/data_outputs/combined_cut_df-全部电表.pkl')
+        time_range = self.context.time_range
         start_time_str = time_range['start_time'].strftime('%Y-%m-%d %H:%M:%S')
         end_time_str = time_range['end_time'].strftime('%Y-%m-%d %H:%M:%S')
         self.start_time_label.setText(f"开始时间: {start_time_str}")
         self.end_time_label.setText(f"结束时间: {end_time_str}")
 
-    def build_tree(self, tree_data, parent_widget):
-        """递归构建树状结构"""
-        for row in tree_data:
-            # 创建父节点
-            parent_item = QTreeWidgetItem(parent_widget)
-            node_name = row['name']
-            node_id = self.node_mapping.get(node_name, '')  # 获取节点的别名
-
-            # 根据当前显示模式设置节点文本
-            if self.show_alias and node_id:
-                node_text = f"{node_name} ({node_id})"  # 显示节点名称和别名
-            else:
-                node_text = node_name  # 只显示节点名称
-
-            # 检查是否存在 diff 值
-            if node_id in self.diff_values:
-                diff_value = self.diff_values[node_id]
-                node_text += f" (Diff: {diff_value})"  # 显示 diff 值
-
-            parent_item.setText(0, node_text)
-
-            # 递归添加子节点
-            if 'children' in row:
-                self.build_tree(row['children'], parent_item)
-
     def toggle_display_mode(self):
         """切换显示模式"""
         self.show_alias = not self.show_alias  # 切换显示别名的状态
-        self.update_tree_display()  # 更新树状结构的显示内容
-
-    def update_tree_display(self):
-        """更新树状结构的显示内容，保留展开状态"""
-        self.update_item_text(self.tree.invisibleRootItem())  # 从根节点开始更新
-
-    def update_item_text(self, item):
-        """递归更新节点的显示文本"""
-        node_text = item.text(0)
-        node_name = node_text.split(' (')[0]  # 提取节点名称
-        node_id = self.node_mapping.get(node_name, '')  # 获取节点的别名
-
-        # 根据当前显示模式设置节点文本
-        if self.show_alias and node_id:
-            new_text = f"{node_name} ({node_id})"  # 显示节点名称和别名
+        self.model.set_show_alias(self.show_alias)  # 只重新绘制，保留展开状态
+
+    def apply_filter(self, text):
+        """按名称或数据点编码过滤，恢复展开状态和选中项，并展开前若干个匹配节点的祖先"""
+        self.matches = self.node_index.search(text) if text.strip() else []
+        self.updating_view = True
+        self.model.set_filter(self.matches if text.strip() else None)
+        self.restore_view()
+        for node in self.matches[:200]:
+            parent_index = self.model.index_for_node(node).parent()
+            while parent_index.isValid():
+                self.tree.expand(parent_index)
+                parent_index = parent_index.parent()
+        self.updating_view = False
+
+    def restore_view(self):
+        """
+        模型重置后按节点下标恢复展开状态和选中项。
+        被过滤掉的选中节点仍保留在 selection_total 中（合计不变），取消过滤后重新显示为选中。
+        """
+        if self.all_expanded:
+            self.model.fetch_all()
+            self.tree.expandAll()
         else:
-            new_text = node_name  # 只显示节点名称
-
-        # 检查是否存在 diff 值
-        if node_id in self.diff_values:
-            diff_value = self.diff_values[node_id]
-            new_text += f" (Diff: {diff_value})"  # 显示 diff 值
-
-        item.setText(0, new_text)
-
-        # 递归更新子节点的文本
-        for i in range(item.childCount()):
-            self.update_item_text(item.child(i))
+            # 按先序遍历顺序展开，祖先先于后代
+            for node in sorted(self.expanded_nodes):
+                index = self.model.index_for_node(node)
+                if index.isValid():
+                    self.tree.expand(index)
+        selection = QItemSelection()
+        for node in sorted(self.selection_total.selected):
+            index = self.model.index_for_node(node)
+            if index.isValid():
+                selection.select(index, index)
+        # 重新选中时 selection_total.add 对已选节点不做处理，合计不会重复计入
+        self.tree.selectionModel().select(selection, QItemSelectionModel.Select)
+
+    def on_expanded(self, index):
+        if not self.updating_view:
+            self.expanded_nodes.add(index.data(NODE_INDEX_ROLE))
+
+    def on_collapsed(self, index):
+        if not self.updating_view:
+            self.expanded_nodes.discard(index.data(NODE_INDEX_ROLE))
+            self.all_expanded = False
+
+    def jump_to_match(self):
+        """定位到最匹配的节点（不改变多选的选中项）"""
+        # 还在等待过滤时立即执行
+        if self.filter_timer.isActive():
+            self.filter_timer.stop()
+            self.apply_filter(self.search_edit.text())
+        if not self.matches:
+            return
+        node = self.matches[0]
+        index = self.model.index_for_node(node)
+        self.tree.selectionModel().setCurrentIndex(index, QItemSelectionModel.NoUpdate)
+        self.tree.scrollTo(index)
+        print(f"已定位到: {self.node_index.path_text(node)}")
 
     def expand_all_nodes(self):
         """展开树状结构中的所有节点"""
+        self.model.fetch_all()
         self.tree.expandAll()
+        self.all_expanded = True
 
     def collapse_all_nodes(self):
         """收起树状结构中的所有节点"""
         self.tree.collapseAll()
+        self.expanded_nodes.clear()
+        self.all_expanded = False
+
+    def on_selection_changed(self, selected, deselected):
+        """根据本次取消和新增的选中项增量更新总和"""
+        for model_index in deselected.indexes():
+            self.selection_total.remove(model_index.data(NODE_INDEX_ROLE))
+        for model_index in selected.indexes():
+            self.selection_total.add(model_index.data(NODE_INDEX_ROLE))
+        self.update_selection_sum()
 
     def update_selection_sum(self):
-        """更新选中项的diff值总和"""
-        selected_items = self.tree.selectedItems()
-        total = 0.0
-        
-        for item in selected_items:
-            node_text = item.text(0)
-            if "(Diff:" in node_text:
-                # 提取diff值
-                diff_str = node_text.split("(Diff: ")[1].split(")")[0]
-                total += float(diff_str)
-        
-        # 更新总和显示
-        self.sum_label.setText(f"总和: {total:.2f} KWH")
+        """更新选中项的diff值总和（选中节点计入其子树合计，已选中祖先的节点不重复计入）"""
+        self.sum_label.setText(f"总和: {self.selection_total.total:.2f} KWH")
 
     def show_context_menu(self, position):
         """显示右键菜单"""
-        item = self.tree.currentItem()  # 获取当前选中的项
-        if item:
-            node_text = item.text(0)
-            node_id = self.extract_node_id(node_text)  # 从节点文本中提取 node_id
+        index = self.tree.indexAt(position)  # 获取右键位置的节点
+        if index.isValid():
+            node_id = index.data(NODE_ID_ROLE)  # 从数据角色中读取 node_id
             menu = QMenu(self.tree)
             
             if node_id:
@@ -219,88 +252,20 @@ class TreeWidgetDemo(QWidget):
     def clear_selection(self):
         """清除所有选中项"""
         self.tree.clearSelection()
-        self.sum_label.setText("总和: 0.00")
-
-    def extract_node_id(self, node_text):
-        """从节点文本中提取 node_id"""
-        if "(" in node_text and ")" in node_text:
-            return node_text.split("(")[1].split(")")[0]
-        return None
+        self.selection_total.clear()
+        self.update_selection_sum()
 
     def copy_to_clipboard(self, node_id):
         """将 node_id 复制到剪贴板"""
         pyperclip.copy(node_id)
         print(f"已复制 node_id: {node_id}")
 
-def parse_tree_structure(df):
-    """解析树状结构"""
-    tree = []
-    current_nodes = {}
-
-    for index, row in df.iterrows():
-        # 初始化当前行的节点
-        node = None
-
-        # 从 LEVEL0 到 LEVEL5，逐层处理
-        for level in range(6):  # 遍历 LEVEL0 到 LEVEL5
-            level_name = f'LEVEL{level}'
-
-            # 如果当前层级不为空
-            if pd.notna(row[level_name]):
-                # 创建当前层级的节点
-                node = {
-                    'name': row[level_name],
-                    'children': []
-                }
-
-                # 如果当前层级是 LEVEL0，则将其作为根节点
-                if level == 0:
-                    tree.append(node)
-                    current_nodes = {0: node}
-                else:
-                    # 如果当前层级不是 LEVEL0，则将其添加到父节点的 children 中
-                    # 向上追溯到第一个不为空的父节点
-                    for parent_level in range(level - 1, -1, -1):  # 从当前层级的上一级开始向上找
-                        if parent_level in current_nodes:
-                            current_nodes[parent_level]['children'].append(node)
-                            break  # 找到父节点后跳出循环
-
-                    # 更新当前层级的节点映射
-                    current_nodes[level] = node
-
-    return tree
-
-def load_node_mapping(df):
-    """加载节点映射关系"""
-    node_mapping = {}
-    for index, row in df.iterrows():
-        node_name = row['node_name']
-        node_id = row['node_id']
-
-        # 将 NaN 替换为空字符串
-        if pd.isna(node_id):
-            node_id = ''
-
-        node_mapping[node_name] = node_id  # 将 node_name 和 node_id 映射
-    return node_mapping
-
 if __name__ == '__main__':
-    # 定义Excel文件路径
-    excel_path = rf'../Time_Series_Data_Processing/data_inputs/电表结构化清单和名称映射.xlsx'
-
-    # 读取Excel文件的"结构化清单"sheet页
-    df_tree = pd.read_excel(excel_path, sheet_name='结构化清单')
-
-    # 读取Excel文件的"映射关系"sheet页
-    df_mapping = pd.read_excel(excel_path, sheet_name='映射关系')
-
-    # 解析树状结构
-    tree_data = parse_tree_structure(df_tree)
-
-    # 加载节点映射关系
-    node_mapping = load_node_mapping(df_mapping)
+    # 数据上下文：时序数据只读取一次，结构化清单优先从缓存读取
+    context = TreeDataContext(store_dir, excel_path, tree_cache_path, start_time=start_time, end_time=end_time,
+                              days=view_days)
 
     # 启动PyQt应用程序
     app = QApplication(sys.argv)
-    demo = TreeWidgetDemo(tree_data, node_mapping, diff_values)
+    demo = TreeWidgetDemo(context)
     sys.exit(app.exec_())
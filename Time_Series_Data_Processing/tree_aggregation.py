@@ -0,0 +1,278 @@
+import bisect
+import numpy as np
+import pandas as pd
+
+"""
+tree_aggregation.py
+
+电表树的子树用量汇总：
+1. FlatTree 将结构化清单（或 parse_tree_structure 返回的嵌套结构）展开为数组表示（先序遍历顺序）：
+   names[i] 为节点名称，parents[i] 为父节点下标（根节点为 -1），depths[i] 为层级（根节点为 0）；
+2. SubtreeAggregator 根据 load_node_mapping 的 节点名称 -> tagCode 映射，为每个节点取出自身的用量（节点 × 时间桶 矩阵），
+   再按层级从深到浅，每一层用一次 np.add.at 把子树合计累加到父节点上，一次后序遍历得到所有节点、所有时间桶的子树合计；
+   有自身电表数据的节点（如馈线、变压器的上级表）以自身读数作为子树合计，其下游分表已计入该读数，不再累加子节点，
+   只有没有电表数据的节点才汇总子节点，避免同一份电量在各级祖先中重复计入（sum_metered=True 时恢复逐级全部累加）；
+3. 某个 tagCode 的数据变化时，update 只把差值沿父节点链向上累加，不重新计算整棵树；
+4. SelectionTotal 维护树中多选节点的合计：选中节点计入其子树合计，祖先已被选中的节点不再重复计入，
+   每次选中或取消选中只按差值更新（先序遍历中一个节点的子树是连续的下标区间，可以二分查找）。
+用量中的 NaN（没有数据）按 0 参与汇总。
+"""
+
+# 结构化清单中的层级列
+LEVEL_COLUMNS = [f'LEVEL{level}' for level in range(6)]
+
+
+class FlatTree:
+    def __init__(self, names, parents, depths):
+        """
+        :param names: 节点名称列表（先序遍历顺序）
+        :param parents: 父节点下标，根节点为 -1
+        :param depths: 节点层级，根节点为 0
+        """
+        self.names = list(names)
+        self.parents = np.asarray(parents, dtype=np.int64)
+        self.depths = np.asarray(depths, dtype=np.int64)
+        self.child_counts = np.bincount(self.parents[self.parents >= 0], minlength=len(self.names))
+        # 子树节点数（含自身）：先序遍历顺序下，节点 i 的子树为下标区间 [i, i + subtree_sizes[i])
+        self.subtree_sizes = np.ones(len(self.names), dtype=np.int64)
+        for depth in range(int(self.depths.max(initial=0)), 0, -1):
+            nodes = np.flatnonzero(self.depths == depth)
+            np.add.at(self.subtree_sizes, self.parents[nodes], self.subtree_sizes[nodes])
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_nested(cls, tree_data):
+        """由 parse_tree_structure 返回的嵌套结构 [{'name': ..., 'children': [...]}, ...] 构建"""
+        names, parents, depths = [], [], []
+        stack = [(node, -1, 0) for node in reversed(tree_data)]
+        while stack:
+            node, parent, depth = stack.pop()
+            index = len(names)
+            names.append(node['name'])
+            parents.append(parent)
+            depths.append(depth)
+            stack.extend((child, index, depth + 1) for child in reversed(node.get('children', [])))
+        return cls(names, parents, depths)
+
+    @classmethod
+    def from_levels(cls, df, level_columns=LEVEL_COLUMNS):
+        """
+        由结构化清单（LEVEL0 ~ LEVEL5 列）直接构建，结果与 from_nested(parse_tree_structure(df)) 相同，但不逐行逐格处理：
+        1. 按行、再按层级的顺序取出所有非空单元格，即节点的创建顺序；
+        2. 对每个层级，向前填充"此前最近一次出现在该层级的节点"，遇到 LEVEL0 节点时其他层级清空，
+           得到每个节点创建时各层级的当前节点；
+        3. 父节点为比自身层级小的层级中、最深的当前节点（与逐行解析一样，较深层级的当前节点在换到较浅层级时不会被清空）；
+           第一个 LEVEL0 之前出现的节点没有父节点，与其后代一起丢弃；
+        4. 按 (祖先链, 创建顺序) 排序得到先序遍历顺序，同一父节点下的子节点保持创建顺序。
+        """
+        cells = df[list(level_columns)].to_numpy(dtype=object)
+        present = pd.notna(cells)
+        rows, levels = np.nonzero(present)  # 按行优先顺序，即节点的创建顺序
+        names = cells[rows, levels]
+        count = len(names)
+        level_count = len(level_columns)
+
+        # 每个层级上最近一次的事件：该层级出现节点，或 LEVEL0 出现节点（清空其他层级）
+        order = np.arange(count)
+        events = np.where((levels[:, None] == np.arange(level_count)) | (levels[:, None] == 0), order[:, None], -1)
+        last = np.maximum.accumulate(events, axis=0) if count else events
+        current = np.where((last >= 0) & (levels[np.maximum(last, 0)] == np.arange(level_count)), last, -1)
+        # 节点创建之前各层级的当前节点
+        before = np.vstack([np.full((1, level_count), -1), current[:-1]]) if count else current
+
+        # 父节点：层级小于自身的已有当前节点中最深的一个
+        candidates = (before >= 0) & (np.arange(level_count) < levels[:, None])
+        parent_levels = np.where(candidates, np.arange(level_count), -1).max(axis=1, initial=-1)
+        parents = np.where(parent_levels >= 0, before[order, np.maximum(parent_levels, 0)], -1)
+
+        # 父节点总是先于子节点创建，按层数迭代即可求出深度和需要丢弃的节点
+        orphan = (parents < 0) & (levels > 0)
+        depths = np.zeros(count, dtype=np.int64)
+        has_parent = parents >= 0
+        for _ in range(level_count):
+            depths = np.where(has_parent, depths[np.maximum(parents, 0)] + 1, 0)
+            orphan = orphan | (has_parent & orphan[np.maximum(parents, 0)])
+
+        # 祖先链矩阵：paths[i, d] 为节点 i 在深度 d 上的祖先（含自身），更深的位置为 -1
+        keep = np.flatnonzero(~orphan)
+        max_depth = int(depths[keep].max(initial=0))
+        paths = np.full((len(keep), max_depth + 1), -1, dtype=np.int64)
+        ancestors = keep.copy()
+        for step in range(max_depth + 1):
+            valid = ancestors >= 0
+            paths[np.flatnonzero(valid), depths[keep][valid] - step] = ancestors[valid]
+            ancestors = np.where(valid, parents[np.maximum(ancestors, 0)], -1)
+        preorder = keep[np.lexsort(paths.T[::-1])] if len(keep) else keep
+
+        positions = np.full(count, -1, dtype=np.int64)
+        positions[preorder] = np.arange(len(preorder))
+        new_parents = np.where(parents[preorder] >= 0, positions[np.maximum(parents[preorder], 0)], -1)
+        return cls(names[preorder].tolist(), new_parents, depths[preorder])
+
+    def to_nested(self):
+        """转换回 parse_tree_structure 的嵌套结构 [{'name': ..., 'children': [...]}, ...]"""
+        nodes = [{'name': name, 'children': []} for name in self.names]
+        tree = []
+        for node, parent in zip(nodes, self.parents.tolist()):
+            (tree if parent < 0 else nodes[parent]['children']).append(node)
+        return tree
+
+    def children(self, index):
+        """返回节点的子节点下标"""
+        return np.flatnonzero(self.parents == index)
+
+    def ancestors(self, index):
+        """返回节点的所有祖先下标（由近到远）"""
+        result = []
+        parent = self.parents[index]
+        while parent >= 0:
+            result.append(int(parent))
+            parent = self.parents[parent]
+        return result
+
+
+class SubtreeAggregator:
+    def __init__(self, flat_tree, node_mapping, tagCodes, matrix, sum_metered=False):
+        """
+        :param flat_tree: FlatTree
+        :param node_mapping: 节点名称 -> tagCode，没有数据点的节点映射为空字符串
+        :param tagCodes: matrix 每一行对应的 tagCode
+        :param matrix: tagCode × 时间桶 的用量矩阵（如 RollupCube.level 返回的矩阵），一维时视为只有一个时间桶
+        :param sum_metered: 为 False（默认）时有电表数据的节点的子树合计就是自身读数；
+                            为 True 时自身读数与子节点合计相加（仅适用于父节点电表不包含子节点用量的结构）
+        """
+        self.tree = flat_tree
+        self.sum_metered = sum_metered
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.ndim == 1:
+            matrix = matrix[:, None]
+        rows = {tagCode: row for row, tagCode in enumerate(tagCodes)}
+        # 每个节点对应 matrix 中的行，没有映射或没有数据的节点为 -1
+        self.node_rows = np.array([rows.get(node_mapping.get(name, ''), -1) for name in flat_tree.names],
+                                  dtype=np.int64)
+        self.tag_nodes = {}
+        for node, row in enumerate(self.node_rows):
+            if row >= 0:
+                self.tag_nodes.setdefault(tagCodes[row], []).append(node)
+
+        self.own = np.zeros((len(flat_tree), matrix.shape[1]))
+        # 有电表数据的节点（映射的 tagCode 在 matrix 中）
+        self.metered = self.node_rows >= 0
+        self.own[self.metered] = np.nan_to_num(matrix[self.node_rows[self.metered]])
+        self.subtree = self._aggregate(self.own)
+
+    @classmethod
+    def from_totals(cls, flat_tree, node_mapping, totals, sum_metered=False):
+        """由 {tagCode: 用量合计} 字典（如 calculate_diff_values 的结果）构建，只有一个时间桶"""
+        tagCodes = list(totals)
+        return cls(flat_tree, node_mapping, tagCodes, np.array([totals[t] for t in tagCodes], dtype=np.float64),
+                   sum_metered)
+
+    @classmethod
+    def from_cube(cls, flat_tree, node_mapping, cube, level, sum_metered=False):
+        """由 RollupCube 某个粒度的汇总构建，时间轴保存在 axis 属性中"""
+        axis, tagCodes, matrix = cube.level(level)
+        aggregator = cls(flat_tree, node_mapping, tagCodes, matrix, sum_metered)
+        aggregator.axis = axis
+        return aggregator
+
+    def _aggregate(self, own):
+        """
+        按层级从深到浅，将每一层节点的子树合计累加到父节点，得到所有节点的子树合计；
+        父节点有电表数据时（sum_metered 为 False）不累加，其子树合计保持为自身读数。
+        """
+        subtree = own.copy()
+        depths = self.tree.depths
+        parents = self.tree.parents
+        for depth in range(int(depths.max(initial=0)), 0, -1):
+            nodes = np.flatnonzero(depths == depth)
+            if not self.sum_metered:
+                nodes = nodes[~self.metered[parents[nodes]]]
+            np.add.at(subtree, parents[nodes], subtree[nodes])
+        return subtree
+
+    def update(self, tagCode, values):
+        """
+        某个 tagCode 的用量变化时，只更新映射到它的节点及其祖先（到第一个有电表数据的祖先为止，该祖先的合计为自身读数）。
+        :param tagCode: 数据变化的 tagCode
+        :param values: 新的用量（每个时间桶一个值，或单个值）
+        """
+        values = np.nan_to_num(np.broadcast_to(np.asarray(values, dtype=np.float64), (self.own.shape[1],)))
+        for node in self.tag_nodes.get(tagCode, []):
+            delta = values - self.own[node]
+            self.own[node] = values
+            self.subtree[node] += delta
+            for ancestor in self.tree.ancestors(node):
+                if self.metered[ancestor] and not self.sum_metered:
+                    break
+                self.subtree[ancestor] += delta
+
+    def totals(self):
+        """每个节点在所有时间桶上的子树合计"""
+        return self.subtree.sum(axis=1)
+
+    def find(self, name):
+        """按名称查找节点下标"""
+        return [index for index, node_name in enumerate(self.tree.names) if node_name == name]
+
+
+class SelectionTotal:
+    def __init__(self, flat_tree, values):
+        """
+        :param flat_tree: FlatTree（先序遍历顺序）
+        :param values: 每个节点被选中时计入的值，一般为 SubtreeAggregator.totals() 的子树合计
+        """
+        self.tree = flat_tree
+        self.values = values
+        self.selected = set()
+        self.counted = []  # 当前计入合计的节点下标（有序），即祖先都未被选中的已选节点
+        self.total = 0.0
+
+    def _covered(self, index):
+        """节点是否有已选中的祖先"""
+        return any(ancestor in self.selected for ancestor in self.tree.ancestors(index))
+
+    def _counted_in_subtree(self, index):
+        """返回子树（不含自身）中当前计入合计的节点在 counted 中的下标范围"""
+        end = index + self.tree.subtree_sizes[index]
+        return bisect.bisect_right(self.counted, index), bisect.bisect_left(self.counted, end)
+
+    def add(self, index):
+        """选中一个节点"""
+        if index in self.selected:
+            return
+        self.selected.add(index)
+        if self._covered(index):
+            return
+        # 子树中已计入的节点改为由当前节点覆盖
+        begin, end = self._counted_in_subtree(index)
+        for node in self.counted[begin:end]:
+            self.total -= self.values[node]
+        del self.counted[begin:end]
+        bisect.insort(self.counted, index)
+        self.total += self.values[index]
+
+    def remove(self, index):
+        """取消选中一个节点"""
+        if index not in self.selected:
+            return
+        self.selected.discard(index)
+        position = bisect.bisect_left(self.counted, index)
+        if position == len(self.counted) or self.counted[position] != index:
+            return  # 被祖先覆盖，不影响合计
+        del self.counted[position]
+        self.total -= self.values[index]
+        # 子树中没有其他已选祖先的已选节点重新计入（按先序遍历顺序处理，先计入的节点会覆盖其后代）
+        end = index + self.tree.subtree_sizes[index]
+        for node in sorted(node for node in self.selected if index < node < end):
+            if not self._covered(node):
+                bisect.insort(self.counted, node)
+                self.total += self.values[node]
+
+    def clear(self):
+        """清除所有选中节点"""
+        self.selected.clear()
+        self.counted.clear()
+        self.total = 0.0
@@ -0,0 +1,164 @@
+import os
+import pickle
+import hashlib
+import pandas as pd
+from parquet_store import read_store, store_dates
+from tree_aggregation import FlatTree
+
+"""
+tree_data_context.py
+
+tree.py 使用的数据上下文，替代每次启动时重复读取数据和解析 Excel：
+1. 时序数据（time、tagCode、diff 三列）只从 Parquet 存储读取一次，每个 tagCode 的 diff 合计和时间范围由同一份数据计算并缓存；
+   存储中累积了所有运行的历史，只按 start_time / end_time 读取需要的时间窗口（分区和行组在读取前过滤），
+   不指定时默认取存储中最近 days 天的数据，启动时间和内存占用不随历史增长；
+2. 电表结构化清单（结构化清单、映射关系两个 sheet）解析为 FlatTree 和映射字典（均为整表向量化处理，不逐行遍历），
+   保存到二进制缓存文件（pickle）中，下次启动时直接读取缓存，不再解析 Excel；
+3. 缓存中记录 Excel 文件的修改时间、大小和 SHA-1，修改时间和大小不变时直接使用缓存，
+   变化时再比较 SHA-1，内容确实改变才重新解析并更新缓存。
+"""
+
+# 缓存格式版本，缓存内容的结构变化时递增，旧缓存自动失效
+CACHE_VERSION = 2
+
+
+def parse_tree_structure(df):
+    """解析树状结构，返回嵌套结构 [{'name': ..., 'children': [...]}, ...]"""
+    return FlatTree.from_levels(df).to_nested()
+
+
+def load_node_mapping(df):
+    """加载节点映射关系，没有数据点编码（NaN）的节点映射为空字符串"""
+    node_ids = df['node_id'].astype(object).where(df['node_id'].notna(), '')
+    return dict(zip(df['node_name'], node_ids))
+
+
+def file_signature(path, sha1=True):
+    """返回文件的修改时间、大小和（可选的）SHA-1"""
+    stat = os.stat(path)
+    signature = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    if sha1:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        signature['sha1'] = digest.hexdigest()
+    return signature
+
+
+class TreeDataContext:
+    def __init__(self, store_dir, excel_path, cache_path=None, start_time=None, end_time=None, days=1):
+        """
+        :param store_dir: get_data_from_api.py 写出的 Parquet 存储目录
+        :param excel_path: 电表结构化清单和名称映射 Excel 文件路径
+        :param cache_path: 解析结果的缓存文件路径，None 表示保存在 Excel 文件旁（文件名后加 .cache.pkl）
+        :param start_time: 汇总的起始时间（包含），None 表示截止时间所在日期往前共 days 天
+        :param end_time: 汇总的截止时间（包含），None 表示存储中最后一天的结束
+        :param days: 未指定 start_time 时读取的天数
+        """
+        self.store_dir = store_dir
+        self.start_time = start_time
+        self.end_time = end_time
+        self.days = days
+        self.excel_path = excel_path
+        self.cache_path = cache_path or f"{excel_path}.cache.pkl"
+        self._series = None
+        self._diff_values = None
+        self._time_range = None
+        self._tree = None
+
+    def window(self):
+        """实际读取的时间窗口 (起始时间, 截止时间)，由 start_time / end_time / days 确定"""
+        end = pd.Timestamp(self.end_time) if self.end_time is not None else None
+        if end is None:
+            dates = store_dates(self.store_dir)
+            if not dates:
+                return None, None
+            end = pd.Timestamp(dates[-1]) + pd.Timedelta(days=1) - pd.Timedelta(1)
+        start = pd.Timestamp(self.start_time) if self.start_time is not None else \
+            end.normalize() - pd.Timedelta(days=self.days - 1)
+        return start, end
+
+    @property
+    def series(self):
+        """时间窗口内的时序数据（time、tagCode、diff 三列），首次访问时读取"""
+        if self._series is None:
+            start, end = self.window()
+            self._series = read_store(self.store_dir, columns=['time', 'tagCode', 'diff'],
+                                      start_time=start, end_time=end)
+        return self._series
+
+    @property
+    def diff_values(self):
+        """每个 tagCode 的 diff 合计 {tagCode: 合计}，保留两位小数"""
+        if self._diff_values is None:
+            diff_sum = self.series.groupby('tagCode', observed=True)['diff'].sum().round(2)
+            self._diff_values = {str(tagCode): value for tagCode, value in diff_sum.items()}
+        return self._diff_values
+
+    @property
+    def time_range(self):
+        """数据的时间范围 {'start_time': ..., 'end_time': ...}，窗口内没有数据时为窗口本身"""
+        if self._time_range is None:
+            times = self.series['time']
+            if times.empty:
+                start, end = self.window()
+                self._time_range = {'start_time': start, 'end_time': end}
+            else:
+                self._time_range = {'start_time': times.min(), 'end_time': times.max()}
+        return self._time_range
+
+    @property
+    def flat_tree(self):
+        """结构化清单解析得到的 FlatTree（先序遍历顺序）"""
+        return self._load_tree()[0]
+
+    @property
+    def node_mapping(self):
+        """load_node_mapping 加载的 节点名称 -> tagCode 映射"""
+        return self._load_tree()[1]
+
+    def _load_tree(self):
+        if self._tree is None:
+            self._tree = self._read_cache()
+            if self._tree is None:
+                self._tree = self._parse_excel()
+        return self._tree
+
+    def _read_cache(self):
+        """读取缓存，缓存不存在、版本不符或 Excel 内容已改变时返回 None"""
+        if not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if cache.get('version') != CACHE_VERSION:
+            return None
+        cached = cache['signature']
+        signature = file_signature(self.excel_path, sha1=False)
+        if signature['mtime_ns'] != cached['mtime_ns'] or signature['size'] != cached['size']:
+            # 修改时间或大小变化时比较内容，内容未变（如文件被复制或重新保存）只更新缓存中的签名
+            signature = file_signature(self.excel_path)
+            if signature['sha1'] != cached['sha1']:
+                return None
+            self._write_cache(cache['flat_tree'], cache['node_mapping'], signature)
+        return cache['flat_tree'], cache['node_mapping']
+
+    def _write_cache(self, flat_tree, node_mapping, signature):
+        cache = {'version': CACHE_VERSION, 'signature': signature, 'flat_tree': flat_tree, 'node_mapping': node_mapping}
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.cache_path)
+
+    def _parse_excel(self):
+        """解析 Excel 并写入缓存"""
+        signature = file_signature(self.excel_path)
+        sheets = pd.read_excel(self.excel_path, sheet_name=['结构化清单', '映射关系'])
+        flat_tree = FlatTree.from_levels(sheets['结构化清单'])
+        node_mapping = load_node_mapping(sheets['映射关系'])
+        self._write_cache(flat_tree, node_mapping, signature)
+        print(f"已解析电表结构化清单并缓存到: {self.cache_path}")
+        return flat_tree, node_mapping
@@ -0,0 +1,188 @@
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex
+
+"""
+tree_model.py
+
+基于 QAbstractItemModel 的电表树模型，替代启动时为每个节点创建 QTreeWidgetItem 的做法：
+1. 节点数据保存在 FlatTree 的数组中，QModelIndex 的 internalId 即节点在 flat_tree 中的下标，不为节点创建任何 Qt 对象；
+2. 子节点在展开时才通过 canFetchMore / fetchMore 分批加载，启动时只加载根节点；
+3. 显示文本、数据点编码和子树合计在视图请求时才从数据层（SubtreeAggregator 的汇总结果）中读取；
+4. set_filter 只显示给定的节点（如 NodeIndex.search 的结果）及其祖先；过滤会重置模型，视图按节点下标（NODE_INDEX_ROLE）恢复选中和展开状态。
+"""
+
+# 节点的数据角色：节点在 flat_tree 中的下标、数据点编码（tagCode）、子树合计
+NODE_INDEX_ROLE = Qt.UserRole
+NODE_ID_ROLE = Qt.UserRole + 1
+NODE_VALUE_ROLE = Qt.UserRole + 2
+
+
+class MeterTreeModel(QAbstractItemModel):
+    def __init__(self, flat_tree, node_ids, own_values, subtree_values, header='石家庄基地', batch_size=256, parent=None):
+        """
+        :param flat_tree: FlatTree（先序遍历顺序）
+        :param node_ids: 每个节点的数据点编码（tagCode），没有数据点的节点为空字符串
+        :param own_values: 每个节点自身的 diff 值，没有数据点的节点为 None
+        :param subtree_values: 每个节点的子树合计（如 SubtreeAggregator.totals()）
+        :param header: 表头文字
+        :param batch_size: 每次 fetchMore 加载的子节点数量
+        """
+        super().__init__(parent)
+        self.flat_tree = flat_tree
+        self.node_ids = node_ids
+        self.own_values = own_values
+        self.subtree_values = subtree_values
+        self.header = header
+        self.batch_size = batch_size
+        self.show_alias = False
+        self.visible = None  # 过滤后可见的节点（布尔数组），None 表示不过滤
+        self.inserting = False  # 正在插入行时不再响应视图的 fetchMore，避免嵌套插入
+        self._build_children()
+
+    def _build_children(self):
+        """根据过滤条件生成每个节点的可见子节点列表及节点在父节点中的行号"""
+        parents = self.flat_tree.parents
+        nodes = np.arange(len(self.flat_tree)) if self.visible is None else np.flatnonzero(self.visible)
+        self.root_children = []
+        self.children = {}
+        self.rows = np.zeros(len(self.flat_tree), dtype=np.int64)
+        for node in nodes.tolist():
+            siblings = self.root_children if parents[node] < 0 else self.children.setdefault(int(parents[node]), [])
+            self.rows[node] = len(siblings)
+            siblings.append(node)
+        # 已加载的子节点数量，根节点下的节点直接加载
+        self.loaded = {-1: len(self.root_children)}
+
+    def _children_of(self, node):
+        return self.root_children if node < 0 else self.children.get(node, [])
+
+    @staticmethod
+    def _node(index):
+        return index.internalId() if index.isValid() else -1
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self._node(parent)
+        if column != 0 or row < 0 or row >= self.loaded.get(node, 0):
+            return QModelIndex()
+        return self.createIndex(row, column, self._children_of(node)[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = int(self.flat_tree.parents[index.internalId()])
+        if parent < 0:
+            return QModelIndex()
+        return self.createIndex(int(self.rows[parent]), 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return self.loaded.get(self._node(parent), 0)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        return len(self._children_of(self._node(parent))) > 0
+
+    def canFetchMore(self, parent):
+        node = self._node(parent)
+        return not self.inserting and self.loaded.get(node, 0) < len(self._children_of(node))
+
+    def fetchMore(self, parent):
+        """展开节点时分批加载子节点"""
+        node = self._node(parent)
+        self._load(parent, node, self.loaded.get(node, 0) + self.batch_size)
+
+    def _load(self, parent, node, count):
+        """将节点已加载的子节点数量增加到 count（不超过子节点总数）"""
+        loaded = self.loaded.get(node, 0)
+        count = min(count, len(self._children_of(node)))
+        if self.inserting or count <= loaded:
+            return
+        self.inserting = True
+        self.beginInsertRows(parent, loaded, count - 1)
+        self.loaded[node] = count
+        self.endInsertRows()
+        self.inserting = False
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.header
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalId()
+        if role == Qt.DisplayRole:
+            return self.node_text(node)
+        if role == NODE_INDEX_ROLE:
+            return node
+        if role == NODE_ID_ROLE:
+            return self.node_ids[node]
+        if role == NODE_VALUE_ROLE:
+            return float(self.subtree_values[node])
+        return None
+
+    def node_text(self, node):
+        """生成节点的显示文本"""
+        node_name = self.flat_tree.names[node]
+        node_id = self.node_ids[node]
+        # 根据当前显示模式设置节点文本
+        if self.show_alias and node_id:
+            node_text = f"{node_name} ({node_id})"  # 显示节点名称和别名
+        else:
+            node_text = node_name  # 只显示节点名称
+        # 检查是否存在 diff 值
+        if self.own_values[node] is not None:
+            node_text += f" (Diff: {self.own_values[node]})"  # 显示 diff 值
+        # 有子节点且自身没有电表数据的节点显示子节点的合计（有电表数据的节点的合计就是自身的 diff 值）
+        if self.flat_tree.child_counts[node] and self.own_values[node] is None:
+            node_text += f" (合计: {self.subtree_values[node]:.2f})"
+        return node_text
+
+    def set_show_alias(self, show_alias):
+        """切换是否显示别名，只通知视图重新绘制，不重建模型，展开状态保持不变"""
+        self.show_alias = show_alias
+        self.layoutAboutToBeChanged.emit()
+        self.layoutChanged.emit()
+
+    def set_filter(self, matches):
+        """
+        只显示匹配的节点及其祖先。
+        :param matches: 匹配的节点下标列表，None 表示取消过滤
+        """
+        self.beginResetModel()
+        if matches is not None:
+            visible = np.zeros(len(self.flat_tree), dtype=bool)
+            for node in matches:
+                while node >= 0 and not visible[node]:
+                    visible[node] = True
+                    node = int(self.flat_tree.parents[node])
+            self.visible = visible
+        else:
+            self.visible = None
+        self._build_children()
+        self.endResetModel()
+
+    def index_for_node(self, node):
+        """返回节点的 QModelIndex，必要时先加载其祖先的子节点；节点被过滤掉时返回无效的 QModelIndex"""
+        if self.visible is not None and not self.visible[node]:
+            return QModelIndex()
+        path = [node] + self.flat_tree.ancestors(node)
+        parent_index = QModelIndex()
+        for current in reversed(path):
+            parent = int(self.flat_tree.parents[current])
+            row = int(self.rows[current])
+            if self.loaded.get(parent, 0) <= row:
+                self._load(parent_index, parent, row + 1)
+            parent_index = self.index(row, 0, parent_index)
+        return parent_index
+
+    def fetch_all(self):
+        """加载所有节点（全部展开时使用）"""
+        for node in range(len(self.flat_tree)):
+            children = self._children_of(node)
+            if self.loaded.get(node, 0) < len(children):
+                self._load(self.index_for_node(node), node, len(children))
@@ -0,0 +1,263 @@
+import os
+import json
+import pandas as pd
+from datetime import datetime
+from api_fetcher import TIME_FORMAT, split_time_range
+
+"""
+ts_cache.py
+
+本地磁盘时序数据缓存，按 tagCode 和时间范围组织，避免重复下载已经拉取过的数据。
+目录结构如下：
+    cache_dir/
+        <tagCode>/
+            ranges.json        已缓存的时间范围列表 [[起始时间, 截止时间], ...]，相互不重叠且按时间排序
+            2025-03-28.pkl     按天分区的原始数据点（time、tagValue 两列，保持接口返回的原始值）
+
+CachedFetcher 在请求前先计算每个 tag 缺失的时间段，只向 API 请求缺口部分，
+其余部分直接从磁盘读取，返回格式与 BatchFetcher.fetch 一致。
+只有请求成功的时间片才标记为已缓存，重试用尽仍失败的时间片保持缺失，下次运行时重新请求；
+最近 settle 时长内的数据可能还会有延迟入库的点，也不标记为已缓存，下次运行时重新请求。
+
+增量采集模式：WatermarkStore 记录每个 tagCode 已确认拉取完毕的时间点（水位线，没有数据点的表计同样推进），
+collect_incremental 每次只请求从水位线到当前时间的数据并追加到缓存中，适合按 5 分钟间隔定时运行。
+"""
+
+
+def merge_ranges(ranges):
+    """合并重叠或首尾相接的时间范围，ranges 为 [(起始时间, 截止时间), ...]，时间为 Timestamp"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class TimeSeriesCache:
+    def __init__(self, cache_dir, settle='10min'):
+        """
+        :param cache_dir: 缓存根目录，不存在时自动创建
+        :param settle: 稳定时长，如 '10min'；晚于 当前时间 - settle 的部分不标记为已缓存，
+                       服务端延迟入库的点在下次运行时会被重新请求
+        """
+        self.cache_dir = cache_dir
+        self.settle = pd.Timedelta(settle)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def settled_until(self):
+        """当前可以标记为已缓存的最晚时间（当前时间 - settle）"""
+        return pd.Timestamp(datetime.now()) - self.settle
+
+    def _tag_dir(self, tagCode):
+        return os.path.join(self.cache_dir, tagCode)
+
+    def _ranges_path(self, tagCode):
+        return os.path.join(self._tag_dir(tagCode), 'ranges.json')
+
+    def _partition_path(self, tagCode, day):
+        return os.path.join(self._tag_dir(tagCode), f"{day}.pkl")
+
+    def covered_ranges(self, tagCode):
+        """读取已缓存的时间范围，返回 [(起始时间, 截止时间), ...]"""
+        path = self._ranges_path(tagCode)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in json.load(f)]
+
+    def _save_ranges(self, tagCode, ranges):
+        with open(self._ranges_path(tagCode), 'w', encoding='utf-8') as f:
+            json.dump([[start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)] for start, end in ranges], f)
+
+    def missing_ranges(self, tagCode, start_time, end_time):
+        """
+        计算 [start_time, end_time] 中尚未缓存的时间段。
+        :return: [(起始时间, 截止时间), ...]，时间为接口使用的字符串格式
+        """
+        start = pd.Timestamp(start_time)
+        end = pd.Timestamp(end_time)
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in self.covered_ranges(tagCode):
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return [(gap_start.strftime(TIME_FORMAT), gap_end.strftime(TIME_FORMAT)) for gap_start, gap_end in gaps]
+
+    def store(self, tagCode, timeseries, ranges):
+        """
+        写入原始数据点，并将请求成功的时间范围标记为已缓存。
+        晚于 settled_until() 的部分不标记，以便之后补齐延迟到达的数据。
+        :param timeseries: 接口返回的数据点列表 [{'time': ..., 'tagValue': ...}, ...]，可以为空
+        :param ranges: 请求成功的时间范围 [(起始时间, 截止时间), ...]，失败的时间片不应包含在内
+        """
+        os.makedirs(self._tag_dir(tagCode), exist_ok=True)
+
+        if timeseries:
+            df = pd.DataFrame(timeseries, columns=['time', 'tagValue'])
+            days = pd.to_datetime(df['time']).dt.strftime('%Y-%m-%d')
+            for day, day_df in df.groupby(days):
+                path = self._partition_path(tagCode, day)
+                if os.path.exists(path):
+                    day_df = pd.concat([pd.read_pickle(path), day_df], ignore_index=True)
+                # 新数据覆盖旧数据中相同时刻的点
+                day_df = (day_df.drop_duplicates(subset='time', keep='last')
+                          .sort_values(by='time', key=pd.to_datetime)
+                          .reset_index(drop=True))
+                day_df.to_pickle(path)
+
+        settled = self.settled_until()
+        covered = [(pd.Timestamp(start), min(pd.Timestamp(end), settled)) for start, end in ranges]
+        covered = [(start, end) for start, end in covered if start < end]
+        if covered:
+            self._save_ranges(tagCode, merge_ranges(self.covered_ranges(tagCode) + covered))
+
+    def load(self, tagCode, start_time, end_time):
+        """
+        读取 [start_time, end_time] 内的缓存数据点。
+        :return: 数据点列表 [{'time': ..., 'tagValue': ...}, ...]
+        """
+        start = pd.Timestamp(start_time)
+        end = pd.Timestamp(end_time)
+        frames = []
+        for day in pd.date_range(start.normalize(), end.normalize(), freq='D'):
+            path = self._partition_path(tagCode, day.strftime('%Y-%m-%d'))
+            if os.path.exists(path):
+                frames.append(pd.read_pickle(path))
+        if not frames:
+            return []
+
+        df = pd.concat(frames, ignore_index=True)
+        times = pd.to_datetime(df['time'])
+        df = df[(times >= start) & (times <= end)]
+        return df.to_dict('records')
+
+
+def store_results(cache, fetcher, tags, items, failed, start_time, end_time):
+    """
+    将 fetcher.fetch(..., return_failed=True) 的结果写入缓存，每个 tag 只标记请求成功的时间片。
+    接口没有返回数据项的 tag 在请求成功时同样标记为已缓存（该时间段没有数据）。
+    :return: {tagCode: 响应项}，接口没有返回数据项的 tag 不在其中
+    """
+    windows = split_time_range(start_time, end_time, fetcher.slice_size)
+    items_by_tag = {item['tagCode']: item for item in items}
+    for tag in tags:
+        tag_failed = set(failed.get(tag, []))
+        item = items_by_tag.get(tag)
+        cache.store(tag, item.get('timeseries') if item else None,
+                    [window for window in windows if window not in tag_failed])
+    return items_by_tag
+
+
+class CachedFetcher:
+    def __init__(self, fetcher, cache):
+        """
+        :param fetcher: BatchFetcher 实例，用于请求缺失的时间段
+        :param cache: TimeSeriesCache 实例
+        """
+        self.fetcher = fetcher
+        self.cache = cache
+
+    def fetch(self, tagCodes, start_time, end_time):
+        """
+        只向 API 请求缓存中缺失的时间段，再从缓存中读取完整时间范围。
+        :return: 响应项列表，格式与 BatchFetcher.fetch 相同
+        """
+        # 缺口完全相同的 tag 合并到同一组，一起分批请求
+        groups = {}
+        for tag in tagCodes:
+            gaps = tuple(self.cache.missing_ranges(tag, start_time, end_time))
+            if gaps:
+                groups.setdefault(gaps, []).append(tag)
+
+        for gaps, tags in groups.items():
+            for gap_start, gap_end in gaps:
+                print(f"缓存缺口: {gap_start} ~ {gap_end}，请求 {len(tags)} 个 tag")
+                items, failed = self.fetcher.fetch(tags, gap_start, gap_end, return_failed=True)
+                store_results(self.cache, self.fetcher, tags, items, failed, gap_start, gap_end)
+
+        items = []
+        for tag in tagCodes:
+            timeseries = self.cache.load(tag, start_time, end_time)
+            # 与接口保持一致：没有数据点时 timeseries 为 None
+            items.append({'tagCode': tag, 'timeseries': timeseries or None})
+        return items
+
+
+class WatermarkStore:
+    def __init__(self, path):
+        """
+        :param path: 水位线文件路径（JSON），内容为 {tagCode: 已确认拉取完毕的时间}
+        """
+        self.path = path
+        self.watermarks = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.watermarks = json.load(f)
+
+    def get(self, tagCode, default=None):
+        return self.watermarks.get(tagCode, default)
+
+    def update(self, tagCode, timestamp):
+        """水位线只前进不后退"""
+        current = self.watermarks.get(tagCode)
+        if current is None or pd.Timestamp(timestamp) > pd.Timestamp(current):
+            self.watermarks[tagCode] = pd.Timestamp(timestamp).strftime(TIME_FORMAT)
+
+    def save(self):
+        """先写临时文件再替换，避免写入中途中断导致水位线文件损坏"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.watermarks, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def collect_incremental(fetcher, cache, watermarks, tagCodes, default_start_time, end_time=None, align='5min'):
+    """
+    增量采集：每个 tag 只请求从水位线到 end_time 的数据，追加到缓存并将水位线推进到已确认拉取完毕的时间。
+    :param fetcher: BatchFetcher 实例
+    :param cache: TimeSeriesCache 实例，新数据追加到其中
+    :param watermarks: WatermarkStore 实例
+    :param default_start_time: 没有水位线的 tag 使用的起始时间
+    :param end_time: 截止时间，默认为当前时间
+    :param align: 水位线向下取整的粒度，取整后相同的 tag 合并为一组请求
+    :return: 本次拉取到的响应项列表，格式与 BatchFetcher.fetch 相同
+    """
+    if end_time is None:
+        end_time = datetime.now().strftime(TIME_FORMAT)
+
+    # 按取整后的水位线分组，减少请求次数
+    groups = {}
+    for tag in tagCodes:
+        watermark = pd.Timestamp(watermarks.get(tag, default_start_time)).floor(align)
+        groups.setdefault(watermark.strftime(TIME_FORMAT), []).append(tag)
+
+    items = []
+    for group_start, tags in sorted(groups.items()):
+        if pd.Timestamp(group_start) >= pd.Timestamp(end_time):
+            continue
+        print(f"增量采集: {group_start} ~ {end_time}，请求 {len(tags)} 个 tag")
+        group_items, failed = fetcher.fetch(tags, group_start, end_time, return_failed=True)
+        items_by_tag = store_results(cache, fetcher, tags, group_items, failed, group_start, end_time)
+        settled = cache.settled_until()
+        for tag in tags:
+            item = items_by_tag.get(tag)
+            if item is not None:
+                items.append(item)
+            # 水位线为该 tag 已确认拉取完毕的时间：到第一个失败的时间片为止（都成功时为 end_time），且不超过 settled_until()，
+            # 失败的时间片和最近 settle 时长内的数据在下次运行时重新请求；
+            # 请求成功但没有数据点的 tag（离线或停用的表计）同样推进，不会每次都从 default_start_time 重新请求
+            checked = min([pd.Timestamp(end_time), settled] + [pd.Timestamp(start) for start, _ in failed.get(tag, [])])
+            if checked > pd.Timestamp(group_start):
+                watermarks.update(tag, checked)
+
+    watermarks.save()
+    return items